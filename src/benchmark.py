@@ -0,0 +1,435 @@
+import time
+import logging
+import tempfile
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.task import task
+
+from src import snakemake_config
+
+
+from src.network_template import NetworkTemplate
+
+from src.optimize import MODEL_PARAMS
+from src.optimize import OUTPUT_VARS
+from src.optimize import chunk_land_pixels
+from src.optimize import group_pixels
+from src.optimize import load_chunk_input_profiles
+from src.optimize import solve_model
+
+from src.renewable_timeseries import encode_values
+
+from src.representative_periods import select_representative_periods
+
+from src.solver import WarmStart
+
+from src.util import resample_mean
+
+
+def _round_trip(input_profiles, encoding):
+    """Write input profiles to a NetCDF file with ``encoding`` (see encode_values()) and read
+    them again, i.e. return the values as the optimization would read them from a file."""
+    encoded = {}
+    file_encoding = {}
+    for name, input_profile in input_profiles.data_vars.items():
+        encoded[name], file_encoding[name] = encode_values(input_profile, **encoding)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fname = f"{tmp_dir}/input_profiles.nc"
+        xr.Dataset(encoded).to_netcdf(fname, encoding=file_encoding)
+        with xr.open_dataset(fname) as round_trip:
+            return round_trip.load()
+
+
+def _iter_land_pixels(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    time_period_h,
+    representative_periods=None,
+    period_length_h=24,
+    encoding=None,
+    min_land_fraction=0.0,
+):
+    """Yield x, y and the network of all land pixels of a chunk (in the same order as in
+    optimize_network_chunk()), the network is a NetworkTemplate updated for the pixel. If
+    ``encoding`` is given, the input profiles are written with this encoding and read again before
+    they are used, see _round_trip()."""
+    param = load_chunk_input_profiles(
+        pv_timeseries_fname=pv_timeseries_fname,
+        wind_timeseries_fname=wind_timeseries_fname,
+        x_start_idx=x_start_idx,
+        y_start_idx=y_start_idx,
+        chunk_size=chunk_size,
+        time_period_h=time_period_h,
+    )
+    if encoding is not None:
+        param = _round_trip(param, encoding)
+
+    land_pixels = chunk_land_pixels(param, min_land_fraction)
+
+    if representative_periods is not None:
+        param = select_representative_periods(
+            param, representative_periods, period_length_h, pixels=land_pixels
+        )
+
+    network_template = NetworkTemplate(
+        time_coords=param.time, time_weights=param.get("time_weight"), **MODEL_PARAMS
+    )
+
+    for x_idx, y_idx in land_pixels:
+        param_pixel = param.isel(x=[x_idx], y=[y_idx])
+        x, y = param_pixel.x.item(), param_pixel.y.item()
+
+        network = network_template.update_input_profiles(
+            pv_input_profile=param_pixel.pv_input_profile,
+            wind_input_profile=param_pixel.wind_input_profile,
+        )
+
+        yield x, y, network
+
+
+def _add_relative_errors(results, reference_mode, names):
+    """Add columns rel_error_<name> with the error relative to the result of the same pixel in
+    ``reference_mode``."""
+    reference = results[results["mode"] == reference_mode].set_index(["x", "y"])
+    for name in names:
+        reference_values = reference[name].reindex(pd.MultiIndex.from_frame(results[["x", "y"]]))
+        results[f"rel_error_{name}"] = results[name] / reference_values.values - 1
+
+
+def _write_results(results, fname):
+    results = pd.DataFrame(results)
+    logging.info(f"Mean per pixel:\n{results.groupby('mode').mean(numeric_only=True)}")
+    results.to_csv(fname, index=False)
+
+
+@task
+def benchmark_warmstart(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    time_period_h="1h",
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Optimize all land pixels of one chunk twice, once with a cold start for each pixel and once
+    warm started from the previous pixel (in the same order as in optimize_network_chunk()), and
+    write solver run time and iteration counts per pixel to a CSV file."""
+    solver_name = snakemake_config.config["solver"]
+
+    # one warm start object shared by all pixels, None means a cold start for each pixel
+    modes = {"cold": None, "warm": WarmStart()}
+
+    results = []
+    for x, y, network in _iter_land_pixels(
+        pv_timeseries_fname,
+        wind_timeseries_fname,
+        x_start_idx,
+        y_start_idx,
+        chunk_size,
+        time_period_h,
+        min_land_fraction=min_land_fraction,
+    ):
+        for mode, warmstart in modes.items():
+            t0 = time.time()
+            stats = solve_model(
+                network.model,
+                network.optimize,
+                solver_name,
+                {"io_api": "direct"},
+                warmstart=warmstart,
+            )
+            results.append({"x": x, "y": y, "mode": mode, "runtime": time.time() - t0, **stats})
+
+    _write_results(results, outputs[0])
+
+
+@task
+def benchmark_io_api(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    time_period_h="1h",
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Optimize all land pixels of one chunk twice, once with linopy writing the model to a LP
+    file in solver_dir and once passing the model to the solver in memory (io_api="direct"), and
+    write the run time per pixel to a CSV file."""
+    solver_name = snakemake_config.config["solver"]
+
+    results = []
+    for x, y, network in _iter_land_pixels(
+        pv_timeseries_fname,
+        wind_timeseries_fname,
+        x_start_idx,
+        y_start_idx,
+        chunk_size,
+        time_period_h,
+        min_land_fraction=min_land_fraction,
+    ):
+        for mode, io_api in (("file", "lp"), ("direct", "direct")):
+            t0 = time.time()
+            stats = solve_model(network.model, network.optimize, solver_name, {"io_api": io_api})
+            results.append({"x": x, "y": y, "mode": mode, "runtime": time.time() - t0, **stats})
+
+    _write_results(results, outputs[0])
+
+
+@task
+def benchmark_representative_periods(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    num_periods,
+    period_length_h=24,
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Optimize all land pixels of one chunk with the full hourly time series and with
+    representative periods (see select_representative_periods()) for each number of periods in
+    ``num_periods`` and write run time, objective and sizes per pixel to a CSV file, including the
+    error relative to the full time series."""
+    solver_name = snakemake_config.config["solver"]
+    size_vars = [name for name in OUTPUT_VARS if name.startswith("size_")]
+
+    modes = {"full": None, **{f"periods-{n}": n for n in num_periods}}
+
+    results = []
+    for mode, representative_periods in modes.items():
+        for x, y, network in _iter_land_pixels(
+            pv_timeseries_fname,
+            wind_timeseries_fname,
+            x_start_idx,
+            y_start_idx,
+            chunk_size,
+            time_period_h="1h",
+            representative_periods=representative_periods,
+            period_length_h=period_length_h,
+            min_land_fraction=min_land_fraction,
+        ):
+            t0 = time.time()
+            stats = solve_model(network.model, network.optimize, solver_name)
+            sizes = {name: network.model.solution[name].item() for name in size_vars}
+            results.append(
+                {"x": x, "y": y, "mode": mode, "runtime": time.time() - t0, **stats, **sizes}
+            )
+
+    results = pd.DataFrame(results)
+    _add_relative_errors(results, "full", ["objective"] + size_vars)
+
+    _write_results(results, outputs[0])
+
+
+def _encoding_name(encoding):
+    if encoding.get("dtype") == "uint16":
+        return f"uint16-max{encoding.get('max_value', 1.5)}"
+    return encoding.get("dtype", "float64")
+
+
+@task
+def benchmark_encoding(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    encodings,
+    time_period_h="1h",
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Validate encodings of the renewable time series (see encode_values()): the input profiles
+    of all land pixels of one chunk are written with each encoding in ``encodings`` and read again.
+    The pixels are optimized with the input profiles as they are and with each round trip. The
+    maximum absolute error of the input profiles, objective and sizes per pixel are written to a
+    CSV file, including the error relative to the input profiles as they are.
+
+    The input profiles as read from the input files are the reference, so the files should be
+    written with a lossless encoding (dtype float64, compression does not matter).
+
+    """
+    solver_name = snakemake_config.config["solver"]
+    size_vars = [name for name in OUTPUT_VARS if name.startswith("size_")]
+
+    param = load_chunk_input_profiles(
+        pv_timeseries_fname=pv_timeseries_fname,
+        wind_timeseries_fname=wind_timeseries_fname,
+        x_start_idx=x_start_idx,
+        y_start_idx=y_start_idx,
+        chunk_size=chunk_size,
+        time_period_h=time_period_h,
+    )
+
+    modes = {"reference": None, **{_encoding_name(encoding): encoding for encoding in encodings}}
+
+    results = []
+    for mode, encoding in modes.items():
+        # maximum absolute error per pixel introduced by the encoding
+        errors = abs(_round_trip(param, encoding) - param) if encoding is not None else 0 * param
+        errors = errors.max("time")
+
+        for x, y, network in _iter_land_pixels(
+            pv_timeseries_fname,
+            wind_timeseries_fname,
+            x_start_idx,
+            y_start_idx,
+            chunk_size,
+            time_period_h,
+            encoding=encoding,
+            min_land_fraction=min_land_fraction,
+        ):
+            stats = solve_model(network.model, network.optimize, solver_name)
+            sizes = {name: network.model.solution[name].item() for name in size_vars}
+            max_abs_errors = {
+                f"max_abs_error_{name}": errors[name].sel(x=x, y=y).item()
+                for name in ("pv_input_profile", "wind_input_profile")
+            }
+            results.append({"x": x, "y": y, "mode": mode, **max_abs_errors, **stats, **sizes})
+
+    results = pd.DataFrame(results)
+    _add_relative_errors(results, "reference", ["objective"] + size_vars)
+
+    logging.info(
+        "Maximum absolute error of input profiles and relative error of sizes per encoding:\n"
+        f"{results.filter(like='error').abs().groupby(results['mode']).max()}"
+    )
+    _write_results(results, outputs[0])
+
+
+@task
+def benchmark_deduplication(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    tolerances,
+    time_period_h="1h",
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Report the error of deduplication with a tolerance (see group_pixels()): all land pixels of
+    one chunk are optimized and the solution of each pixel is compared with the solution of its
+    representative, i.e. the solution it gets with deduplication, for exact deduplication and for
+    each tolerance in ``tolerances``. Writes objective and sizes per pixel to a CSV file, including
+    the number of solves, the maximum absolute difference of the input profiles to the
+    representative and the error relative to the pixel's own solution."""
+    solver_name = snakemake_config.config["solver"]
+    size_vars = [name for name in OUTPUT_VARS if name.startswith("size_")]
+
+    full = []
+    for x, y, network in _iter_land_pixels(
+        pv_timeseries_fname,
+        wind_timeseries_fname,
+        x_start_idx,
+        y_start_idx,
+        chunk_size,
+        time_period_h=time_period_h,
+        min_land_fraction=min_land_fraction,
+    ):
+        stats = solve_model(network.model, network.optimize, solver_name)
+        sizes = {name: network.model.solution[name].item() for name in size_vars}
+        full.append({"x": x, "y": y, "objective": stats["objective"], **sizes})
+    full = pd.DataFrame(full)
+
+    # the land pixels in the same order as in _iter_land_pixels()
+    param = load_chunk_input_profiles(
+        pv_timeseries_fname=pv_timeseries_fname,
+        wind_timeseries_fname=wind_timeseries_fname,
+        x_start_idx=x_start_idx,
+        y_start_idx=y_start_idx,
+        chunk_size=chunk_size,
+        time_period_h=time_period_h,
+    )
+    land_pixels = chunk_land_pixels(param, min_land_fraction)
+
+    results = [full.assign(mode="full", num_solves=len(full), max_abs_diff=0.0)]
+    modes = {"exact": None, **{f"tolerance-{tolerance}": tolerance for tolerance in tolerances}}
+    for mode, tolerance in modes.items():
+        representatives, max_abs_diff = group_pixels(param, land_pixels, tolerance)
+        num_solves = len(np.unique(representatives))
+        logging.info(f"{mode}: {num_solves} solves for {len(land_pixels)} land pixels")
+
+        # no need to optimize again, a pixel gets the solution of its representative
+        results.append(
+            full.iloc[representatives].assign(
+                x=full.x.values,
+                y=full.y.values,
+                mode=mode,
+                num_solves=num_solves,
+                max_abs_diff=max_abs_diff,
+            )
+        )
+
+    results = pd.concat(results, ignore_index=True)
+    _add_relative_errors(results, "full", ["objective"] + size_vars)
+
+    _write_results(results, outputs[0])
+
+
+@task
+def benchmark_resample(
+    timeseries_fname,
+    time_period_h,
+    rows_per_block=20,
+    inputs=None,
+    outputs=None,
+):
+    """Resample a yearly time series (e.g. the global wind time series) block by block with
+    xarray.DataArray.resample().mean() and with resample_mean() and write the run time and the
+    maximum absolute difference of both results per block to a CSV file."""
+    timeseries = xr.open_dataarray(timeseries_fname)
+    dim, block_size = "y", rows_per_block
+    if "pixel" in timeseries.dims:
+        # compact time series (land pixels only): as many pixels as rows_per_block full rows
+        dim, block_size = "pixel", rows_per_block * (int(timeseries.x_idx.max()) + 1)
+
+    results = []
+    for start_idx in range(0, timeseries.sizes[dim], block_size):
+        block = timeseries.isel({dim: slice(start_idx, start_idx + block_size)}).load()
+
+        t0 = time.time()
+        expected = block.resample(time=time_period_h).mean()
+        runtime_resample = time.time() - t0
+
+        t0 = time.time()
+        resampled = resample_mean(block, time_period_h)
+        runtime_resample_mean = time.time() - t0
+
+        if (resampled.time.values != expected.time.values).any():
+            raise RuntimeError(f"wrong time stamps for block starting at {dim}={start_idx}")
+
+        results.append(
+            {
+                "start_idx": start_idx,
+                "runtime_resample": runtime_resample,
+                "runtime_resample_mean": runtime_resample_mean,
+                "max_abs_diff": float(np.abs(resampled - expected).max()),
+            }
+        )
+
+    results = pd.DataFrame(results)
+    logging.info(
+        f"Total run time: resample() {results.runtime_resample.sum():.1f}s, resample_mean() "
+        f"{results.runtime_resample_mean.sum():.1f}s, max abs difference: "
+        f"{results.max_abs_diff.max()}"
+    )
+    results.to_csv(outputs[0], index=False)
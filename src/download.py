@@ -1,8 +1,18 @@
 import os
+import glob
+import time
+import fcntl
+import shutil
 import logging
+import contextlib
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
 
 import cdsapi
 import atlite
+import atlite.datasets.era5
+import numpy as np
 import xarray as xr
 
 from src import paths
@@ -10,6 +20,173 @@ from src import snakemake_config
 from src.task import task
 from src.util import create_folder
 
+# atlite features of the ERA5 cutout used to convert to capacity factors of each technology:
+# convert_pv() needs the irradiation and the temperature, convert_wind() the wind speed at 100m and
+# the roughness (height and runoff are not used at all)
+TECHNOLOGY_FEATURES = {
+    "pv": ["influx", "temperature"],
+    "wind": ["wind"],
+}
+
+
+def cutout_features(renewable_params):
+    """Return the atlite features needed for all technologies of all renewable scenarios, see
+    TECHNOLOGY_FEATURES."""
+    technologies = {technology for params in renewable_params.values() for technology in params}
+    unknown = technologies - TECHNOLOGY_FEATURES.keys()
+    if unknown:
+        raise ValueError(f"unknown technologies in renewable_params: {sorted(unknown)}")
+    return sorted({feature for tech in technologies for feature in TECHNOLOGY_FEATURES[tech]})
+
+
+def retrieve_cds(product, request, target):
+    """Download a request from the Climate Data Store to the file ``target``."""
+    client = cdsapi.Client(info_callback=logging.debug)
+    client.retrieve(product, request, target)
+
+
+# backends to download a single request, a backend is a function with the same parameters as
+# retrieve_cds() - tests use a fake backend which creates synthetic data
+ERA5_BACKENDS = {
+    "cds": retrieve_cds,
+}
+
+
+@contextlib.contextmanager
+def download_slot(lock_dir, max_parallel, poll_interval_s=10.0):
+    """Wait for one of ``max_parallel`` download slots, i.e. a semaphore for all processes (jobs)
+    using the same ``lock_dir``. Each slot is a lock file locked with flock(), the lock is
+    released by the OS if the process is killed. Locks work across nodes only if the file system
+    supports flock() (e.g. NFS with lockd, GPFS). Yields the index of the slot."""
+    while True:
+        for slot in range(max_parallel):
+            lock_file = open(os.path.join(lock_dir, f"download-{slot}.lock"), "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+
+            try:
+                yield slot
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+
+        time.sleep(poll_interval_s)
+
+
+def split_request(request):
+    """Split a CDS request into one request per variable and day. Returns a dict with a file
+    name for each part as key and the request of the part as value."""
+    parts = {}
+    year, month = int(request["year"]), int(request["month"])
+    for variable in np.atleast_1d(request["variable"]):
+        for day in np.atleast_1d(request["day"]):
+            fname = f"{variable}_{year:04d}-{month:02d}-{int(day):02d}.nc"
+            parts[fname] = {**request, "variable": [str(variable)], "day": [str(day)]}
+    return parts
+
+
+def download_part(
+    retrieve, product, request, target, lock_dir, max_parallel, max_retries, backoff_s
+):
+    """Download one part of a request to ``target`` unless it exists already (i.e. it has been
+    downloaded by a previous run). Failed downloads are retried ``max_retries`` times, waiting
+    ``backoff_s`` seconds before the first retry and twice as long before each further retry. The
+    part is written to a temporary file first and renamed when complete."""
+    if os.path.exists(target):
+        logging.info(f"Skipping {os.path.basename(target)}, downloaded already")
+        return
+
+    target_tmp = f"{target}.part"
+    for attempt in range(max_retries + 1):
+        try:
+            with download_slot(lock_dir, max_parallel):
+                logging.info(f"Downloading {os.path.basename(target)}...")
+                retrieve(product, request, target_tmp)
+            os.replace(target_tmp, target)
+            return
+        except Exception as e:
+            if os.path.exists(target_tmp):
+                os.remove(target_tmp)
+            if attempt == max_retries:
+                raise
+            wait_s = backoff_s * 2**attempt
+            logging.warning(
+                f"Download of {os.path.basename(target)} failed ({e!r}), retrying in {wait_s}s..."
+            )
+            time.sleep(wait_s)
+
+
+def retrieve_in_parts(
+    product,
+    chunks=None,
+    tmpdir=None,
+    lock=None,
+    parts_dir=None,
+    lock_dir=None,
+    retrieve=retrieve_cds,
+    max_parallel=1,
+    max_retries=5,
+    backoff_s=60.0,
+    **updates,
+):
+    """Download ERA5 data in parts, a replacement for atlite.datasets.era5.retrieve_data() with
+    the same parameters (tmpdir and lock are not used) and the same return value.
+
+    atlite requests all variables of a feature for a whole month at once. Here the request is
+    split into parts of one variable and one day (see split_request()), which are downloaded by
+    ``max_parallel`` threads to ``parts_dir``, see download_part() for the other parameters. Parts
+    downloaded already are not requested again, i.e. a killed job resumes where it stopped.
+
+    """
+    request = {"product_type": "reanalysis", "format": "netcdf", **updates}
+    parts = split_request(request)
+
+    download = functools.partial(
+        download_part,
+        retrieve,
+        product,
+        lock_dir=lock_dir,
+        max_parallel=max_parallel,
+        max_retries=max_retries,
+        backoff_s=backoff_s,
+    )
+    with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+        futures = [
+            executor.submit(download, part_request, os.path.join(parts_dir, fname))
+            for fname, part_request in parts.items()
+        ]
+        # raises the exception of the first part failing for good
+        for future in futures:
+            future.result()
+
+    ds = xr.open_mfdataset(
+        [os.path.join(parts_dir, fname) for fname in parts],
+        combine="by_coords",
+        chunks=chunks or {},
+    )
+
+    # atlite.datasets.era5.retrieve_data() removes the encoding of variables stored as int16 (NaN
+    # values otherwise), the encoding of the parts (e.g. contiguous) does not fit the cutout at all
+    for v in ds.data_vars:
+        ds[v].encoding.clear()
+
+    return ds
+
+
+def remove_temp_files(path, fname):
+    """Remove temporary files left by a killed job: parts downloaded partially and the temporary
+    file of atlite's Cutout.prepare() (tmp*global-YYYY-MM.nc, renamed to the cutout file when
+    complete)."""
+    temp_files = glob.glob(str(path / f"tmp*{fname}.nc"))
+    temp_files += glob.glob(str(path / "parts" / fname / "*.part"))
+    for temp_file in temp_files:
+        logging.info(f"Removing temporary file {temp_file}")
+        os.remove(temp_file)
+
 
 def _create_era5_cutout(inputs, outputs, year, month):
     time_period = f"{year}-{month}"
@@ -32,8 +209,12 @@ def _create_era5_cutout(inputs, outputs, year, month):
         time=time_period,
     )
 
-    # TODO can we specify here some features (PV + wind) only to reduce size of stored data?
-    cutout.prepare()
+    # only features used by the technologies in renewable_params are downloaded and stored, if the
+    # file has been prepared already, only missing features are added (e.g. for a new technology)
+    features = cutout_features(snakemake_config.config["renewable_params"])
+    logging.info(f"Features of the cutout: {', '.join(features)}")
+
+    cutout.prepare(features=features)
 
     return cutout
 
@@ -44,8 +225,38 @@ def create_era5_cutout(inputs, outputs, year, month):
 
 
 @task
-def download_era5(inputs, outputs, year, month):
-    return _create_era5_cutout(inputs, outputs, year, month)
+def download_era5(
+    inputs, outputs, year, month, max_parallel=1, max_retries=5, backoff_s=60.0, backend="cds"
+):
+    """Download ERA5 data for a month and create the cutout, the data is downloaded in parts (see
+    retrieve_in_parts()), parts downloaded by a previous (killed) job are not downloaded again."""
+    path = create_folder("era5", prefix=paths.INPUT_DIR)
+    fname = f"global-{year}-{month}"
+
+    remove_temp_files(path, fname)
+    parts_dir = create_folder(path / "parts" / fname, prefix=None)
+
+    # atlite has no option to change the way data is retrieved, so its download function is
+    # replaced while the cutout is prepared
+    retrieve_data = atlite.datasets.era5.retrieve_data
+    atlite.datasets.era5.retrieve_data = functools.partial(
+        retrieve_in_parts,
+        parts_dir=parts_dir,
+        lock_dir=path,
+        retrieve=ERA5_BACKENDS[backend] if isinstance(backend, str) else backend,
+        max_parallel=max_parallel,
+        max_retries=max_retries,
+        backoff_s=backoff_s,
+    )
+    try:
+        cutout = _create_era5_cutout(inputs, outputs, year, month)
+    finally:
+        atlite.datasets.era5.retrieve_data = retrieve_data
+
+    # the cutout file is complete now, parts are not needed any longer
+    shutil.rmtree(parts_dir, ignore_errors=True)
+
+    return cutout
 
 
 @task
@@ -1,13 +1,53 @@
+import os
 import glob
+import tempfile
+import functools
 
+import numpy as np
 import xarray as xr
 
 from src.paths import INPUT_DIR
 from src.paths import INTERIM_DIR
 
+from src.util import land_mask
+
+LAND_SEA_MASK_FNAME = INPUT_DIR / "land_sea_mask" / "land_sea_mask.nc"
+
 
 def load_land_sea_mask():
-    return xr.open_dataset(INPUT_DIR / "land_sea_mask" / "land_sea_mask.nc").lsm
+    return xr.open_dataset(LAND_SEA_MASK_FNAME).lsm
+
+
+@functools.lru_cache
+def load_land_mask(min_land_fraction=0.0):
+    """Return the boolean land mask with dimensions x and y of the global grid of the renewable
+    time series, i.e. pixels with a land fraction larger than min_land_fraction (see land_mask()).
+
+    The mask is loaded only once per process and stored in a small file next to the land sea mask
+    (about 1MB instead of the land sea mask with 8 bytes per pixel). The file is created on first
+    use and again if the land sea mask is newer.
+
+    """
+    fname = LAND_SEA_MASK_FNAME.parent / f"land_mask_minlandfraction-{min_land_fraction}.nc"
+
+    if not fname.exists() or fname.stat().st_mtime < LAND_SEA_MASK_FNAME.stat().st_mtime:
+        with load_land_sea_mask() as land_sea_mask:
+            is_land = land_mask(land_sea_mask.load(), min_land_fraction)
+
+        # parallel jobs might create the file at the same time, rename it only when complete
+        fd, fname_tmp = tempfile.mkstemp(suffix=".nc", dir=fname.parent)
+        os.close(fd)
+        is_land.to_netcdf(fname_tmp, encoding={"is_land": {"zlib": True}})
+        os.replace(fname_tmp, fname)
+
+    return xr.load_dataarray(fname)
+
+
+def load_grid():
+    """Return the coordinates x and y of the global grid of the renewable time series (the same
+    as the land sea mask sorted by longitude and latitude, see land_mask())."""
+    is_land = load_land_mask()
+    return is_land.x.values, is_land.y.values
 
 
 def load_network_solution():
@@ -18,16 +58,93 @@ def load_network_solution():
     return solution
 
 
-def _load_renewable_timeseries(technology, year):
+def expand_to_grid(compact, x, y, x_slice=slice(None), y_slice=slice(None)):
+    """Expand a compact time series with dimension pixel (only land pixels, see to_compact() in
+    src/renewable_timeseries.py) to the x/y grid, pixels not stored in the compact time series are
+    NaN. Only the pixels of the grid selected by x_slice and y_slice are read.
+
+    The result is lazy if ``compact`` is lazy, i.e. opened with dask chunks.
+
+    Parameters
+    ----------
+    compact : xr.DataArray
+        with dimension pixel and coordinates x_idx and y_idx
+    x, y : np.ndarray
+        coordinates of the global grid, see load_grid()
+    x_slice, y_slice : slice
+        a part of the grid
+
+    Returns
+    -------
+    xr.DataArray
+        with dimensions x, y and all other dimensions of ``compact`` (e.g. time)
+
+    """
+    # position in the compact time series for each pixel of the grid, -1 if not stored
+    grid_pixels = np.full((len(x), len(y)), -1)
+    grid_pixels[compact.x_idx.values, compact.y_idx.values] = np.arange(compact.sizes["pixel"])
+    grid_pixels = grid_pixels[x_slice, y_slice]
+    is_stored = grid_pixels >= 0
+
+    # read only the pixels needed, in the order stored in the file
+    pixels = np.unique(grid_pixels[is_stored])
+    if len(pixels) == 0:
+        # no stored pixels at all, read a single one to get a result with NaN only
+        pixels = np.array([0])
+
+    selected = compact.drop_vars(["x", "y", "x_idx", "y_idx"]).isel(pixel=pixels)
+    expanded = selected.isel(
+        pixel=xr.DataArray(np.searchsorted(pixels, grid_pixels), dims=("x", "y"))
+    )
+    expanded = expanded.where(xr.DataArray(is_stored, dims=("x", "y")))
+
+    return expanded.assign_coords(x=x[x_slice], y=y[y_slice])
+
+
+def load_timeseries_chunk(fname, x_slice, y_slice):
+    """Open a part of a renewable time series file lazily, either a compact time series with
+    land pixels only or one stored on the x/y grid."""
+    timeseries = xr.open_dataarray(fname)
+    if "pixel" in timeseries.dims:
+        return expand_to_grid(timeseries, *load_grid(), x_slice=x_slice, y_slice=y_slice)
+    return timeseries.isel(x=x_slice, y=y_slice)
+
+
+def _expand_in_blocks(compact, x, y, block_size=100):
+    """Expand a compact time series backed by dask to the whole grid, lazily in blocks of
+    block_size x block_size pixels, i.e. selecting a part of the result reads only the pixels of
+    the blocks needed."""
+    blocks = [
+        [
+            expand_to_grid(
+                compact,
+                x,
+                y,
+                x_slice=slice(x_start_idx, x_start_idx + block_size),
+                y_slice=slice(y_start_idx, y_start_idx + block_size),
+            )
+            for y_start_idx in range(0, len(y), block_size)
+        ]
+        for x_start_idx in range(0, len(x), block_size)
+    ]
+    return xr.combine_nested(blocks, concat_dim=["x", "y"])
+
+
+def _load_renewable_timeseries(technology, year, expand=True):
     fname = INTERIM_DIR / "renewable_timeseries" / f"{technology}_{year}.nc"
-    return xr.open_dataarray(fname)
+    timeseries = xr.open_dataarray(fname)
+    if expand and "pixel" in timeseries.dims:
+        # dask chunks are the tiles stored in the file, see tiled_encoding()
+        compact = xr.open_dataarray(fname, chunks={})
+        timeseries = _expand_in_blocks(compact, *load_grid())
+    return timeseries
 
 
-def load_pv(year):
+def load_pv(year, expand=True):
     technology = "pv"
-    return _load_renewable_timeseries(technology, year)
+    return _load_renewable_timeseries(technology, year, expand=expand)
 
 
-def load_wind(year):
+def load_wind(year, expand=True):
     technology = "wind"
-    return _load_renewable_timeseries(technology, year)
+    return _load_renewable_timeseries(technology, year, expand=expand)
@@ -4,6 +4,7 @@ from syfop.node import Node, NodeScalableInput, NodeFixOutput, Storage
 from syfop.network import Network
 
 from src import snakemake_config
+from src.representative_periods import weight_methanol_production
 
 
 def create_methanol_network(
@@ -20,7 +21,17 @@ def create_methanol_network(
     methanol_synthesis_cost,
     methanol_synthesis_convert_factor,
     methanol_synthesis_input_proportions,
+    time_weights=None,
 ):
+    """Create the syfop network for one pixel.
+
+    If ``time_weights`` is given, each time step represents this number of time steps of the
+    original time series (see select_representative_periods()). The methanol demand then needs to
+    be covered by the weighted sum of the methanol production. Storage of electricity, hydrogen
+    and CO2 is linked between consecutive time steps as usual, i.e. between consecutive
+    representative periods, which is only an approximation (see weight_methanol_production()).
+
+    """
 
     # We have a time series where the whole demand is during the last time stamp and a free
     # methanol storage. This is equivalent to a yearly production goal where we don't care when the
@@ -119,4 +130,7 @@ def create_methanol_network(
         solver_dir=snakemake_config.config['solver_dir'],
     )
 
+    if time_weights is not None:
+        weight_methanol_production(network.model, time_weights)
+
     return network
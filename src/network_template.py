@@ -0,0 +1,276 @@
+import logging
+
+import linopy
+import numpy as np
+import xarray as xr
+
+# names of the nodes which use a capacity factor time series as input profile
+PROFILE_NODES = ("solar_pv", "wind")
+
+
+def _find_profile_constraints(model, variable_name):
+    """Find all constraints with a time dimension which contain the size variable of a node with
+    an input profile. These are the constraints where the size is multiplied by the capacity
+    factors. Returns a dict with the constraint name as key and a boolean mask for the terms of the
+    size variable as value.
+
+    """
+    size_labels = np.ravel(model.variables[variable_name].labels)
+
+    profile_constraints = {}
+    for name in model.constraints:
+        constraint = model.constraints[name]
+        if "time" not in constraint.coord_dims:
+            continue
+        is_size = constraint.vars.isin(size_labels)
+        if is_size.any():
+            profile_constraints[name] = is_size
+
+    if not profile_constraints:
+        raise ValueError(f"no constraint with an input profile found for '{variable_name}'")
+
+    return profile_constraints
+
+
+# How the terms (variables and coefficients) of a linopy constraint are replaced, checked once
+# here: linopy 0.3.8 (the pinned version) has setters for vars and coeffs only, newer versions
+# have Constraint.update() and the setters are deprecated (checked with 0.10.0). None if neither
+# is available, then NetworkTemplate creates the network from scratch for each pixel.
+if hasattr(linopy.constraints.Constraint, "update"):
+    CONSTRAINT_TERMS_API = "update"
+elif all(
+    getattr(getattr(linopy.constraints.Constraint, attr, None), "fset", None) is not None
+    for attr in ("vars", "coeffs")
+):
+    CONSTRAINT_TERMS_API = "setters"
+else:
+    CONSTRAINT_TERMS_API = None
+
+
+def set_constraint_terms(constraint, term_vars, term_coeffs):
+    """Replace variables and coefficients of the left-hand side of a linopy constraint in place,
+    see CONSTRAINT_TERMS_API."""
+    if CONSTRAINT_TERMS_API == "update":
+        lhs = linopy.LinearExpression(
+            xr.Dataset({"coeffs": term_coeffs, "vars": term_vars}), constraint.model
+        )
+        constraint.update(lhs=lhs)
+    else:
+        constraint.vars = term_vars
+        constraint.coeffs = term_coeffs
+
+
+class NetworkTemplate:
+    """The methanol network is identical for all pixels, only the input profiles (capacity
+    factors) for PV and wind differ. This class creates the syfop network and its linopy model
+    only once and then replaces the coefficients of the capacity factors in the constraints
+    before each solve.
+
+    If the installed linopy version does not allow to set the terms of a constraint, the network
+    is created from scratch for each pixel in update_input_profiles() instead.
+
+    The template is created with constant input profiles of 1. Then the coefficient of the size
+    variable of a node with an input profile is exactly the coefficient for a capacity factor of
+    1, which is linear in the capacity factor. Therefore it can be multiplied with the input
+    profile of each pixel.
+
+    Parameters
+    ----------
+    time_coords : xr.DataArray
+        time stamps of the input profiles, all pixels need to use the same time stamps
+    create_network : callable
+        function which creates the network given pv_input_profile, wind_input_profile and
+        ``model_params`` and returns an object with the attribute model (linopy.Model) and the
+        method optimize(), by default create_methanol_network()
+    model_params : kwargs
+        all other parameters passed to ``create_network``
+
+    """
+
+    def __init__(self, time_coords, create_network=None, **model_params):
+        if create_network is None:
+            # imported only here, syfop is not needed for other networks
+            from src.methanol_network import create_methanol_network as create_network
+
+        self.time_coords = time_coords.reset_coords(drop=True)
+        self.create_network = create_network
+        self.model_params = model_params
+        self.replace_terms = CONSTRAINT_TERMS_API is not None
+        if not self.replace_terms:
+            logging.warning(
+                f"linopy {linopy.__version__} does not support replacing the terms of a "
+                "constraint, the network is created from scratch for each pixel"
+            )
+
+        ones = xr.ones_like(self.time_coords, dtype=float)
+        self.network = create_network(
+            pv_input_profile=ones,
+            wind_input_profile=ones,
+            **model_params,
+        )
+
+        model = self.network.model
+
+        self._profile_constraints = {
+            node_name: _find_profile_constraints(model, f"size_{node_name}")
+            for node_name in PROFILE_NODES
+        }
+
+        # linopy removes terms with zero coefficients in place when solving (see sanitize_zeros
+        # in linopy.Model.solve()), therefore we need to keep a copy of the original terms and not
+        # only of the coefficients.
+        self._original_terms = {
+            name: (model.constraints[name].vars.copy(), model.constraints[name].coeffs.copy())
+            for profile_constraints in self._profile_constraints.values()
+            for name in profile_constraints
+        }
+
+    def _check_time_coords(self, input_profile, node_name):
+        if not np.array_equal(input_profile.time, self.time_coords):
+            raise ValueError(
+                f"input profile for '{node_name}' does not match the time stamps of the network "
+                "template"
+            )
+
+    def _terms(self, name, input_profiles):
+        """Return variables and coefficients of the constraint ``name`` for the given input
+        profiles."""
+        if name not in self._original_terms:
+            constraint = self.network.model.constraints[name]
+            return constraint.vars, constraint.coeffs
+
+        term_vars, term_coeffs = self._original_terms[name]
+        for node_name, profile_constraints in self._profile_constraints.items():
+            if name in profile_constraints:
+                is_size = profile_constraints[name]
+                term_coeffs = term_coeffs.where(~is_size, term_coeffs * input_profiles[node_name])
+
+        return term_vars, term_coeffs
+
+    def update_input_profiles(self, pv_input_profile, wind_input_profile):
+        """Set the input profiles of a pixel in the linopy model and return the network, which is
+        then ready to be optimized.
+
+        Parameters
+        ----------
+        pv_input_profile : xr.DataArray
+            PV time series of a single pixel (dimensions of length 1 other than time are ignored)
+        wind_input_profile : xr.DataArray
+            wind time series of a single pixel
+
+        """
+        input_profiles = {"solar_pv": pv_input_profile, "wind": wind_input_profile}
+
+        for node_name, input_profile in input_profiles.items():
+            input_profile = input_profile.squeeze(drop=True).reset_coords(drop=True)
+            if input_profile.dims != ("time",):
+                raise ValueError(f"input profile for '{node_name}' is not a single pixel")
+            self._check_time_coords(input_profile, node_name)
+            input_profiles[node_name] = input_profile
+
+        if not self.replace_terms:
+            return self.create_network(
+                pv_input_profile=input_profiles["solar_pv"],
+                wind_input_profile=input_profiles["wind"],
+                **self.model_params,
+            )
+
+        model = self.network.model
+
+        for name in self._original_terms:
+            set_constraint_terms(model.constraints[name], *self._terms(name, input_profiles))
+
+        # linopy 0.3.8 caches the flat representation of the model, which is used to pass the
+        # model directly to the solver (io_api="direct"). Newer versions create it on each access
+        # of model.matrices, so there is nothing to clear (and accessing it would be expensive).
+        if not isinstance(getattr(type(model), "matrices", None), property):
+            for cached in ("flat_vars", "flat_cons", "sol"):
+                model.matrices.__dict__.pop(cached, None)
+
+        return self.network
+
+    def create_batch_model(self, pv_input_profiles, wind_input_profiles):
+        """Create a single linopy model for multiple pixels. The model contains a copy of all
+        variables and constraints of the template for each pixel, i.e. an additional dimension
+        ``pixel`` is added to all variables and constraints. The pixels do not share any variable,
+        so the constraint matrix is block-diagonal and minimizing the sum of all objectives is
+        equivalent to minimizing the objective of each pixel separately.
+
+        Parameters
+        ----------
+        pv_input_profiles : xr.DataArray
+            PV time series with dimensions pixel and time
+        wind_input_profiles : xr.DataArray
+            wind time series with dimensions pixel and time
+
+        Returns
+        -------
+        model : linopy.Model
+            variables have the same names as in the template, with an additional integer
+            dimension ``pixel`` in the same order as the pixels of the input profiles
+        pixel_objective : linopy.LinearExpression
+            objective of each pixel with dimension ``pixel``, the objective of the model is the
+            sum of it
+
+        """
+        template = self.network.model
+
+        num_pixels = pv_input_profiles.sizes["pixel"]
+        pixel = xr.DataArray(np.arange(num_pixels), dims="pixel")
+
+        input_profiles = {"solar_pv": pv_input_profiles, "wind": wind_input_profiles}
+        for node_name, input_profile in input_profiles.items():
+            self._check_time_coords(input_profile, node_name)
+            input_profiles[node_name] = xr.DataArray(
+                input_profile.transpose("pixel", "time").values,
+                coords={"pixel": pixel, "time": self.time_coords},
+            )
+
+        model = linopy.Model(solver_dir=template.solver_dir)
+
+        # maps labels of variables in the template to labels in the batch model for each pixel
+        max_label = max(int(template.variables[name].labels.max()) for name in template.variables)
+        label_map = np.full((num_pixels, max_label + 1), -1)
+
+        for name in template.variables:
+            variable = template.variables[name]
+            mask = variable.labels != -1
+            batch_variable = model.add_variables(
+                lower=variable.lower.expand_dims(pixel=pixel),
+                upper=variable.upper.expand_dims(pixel=pixel),
+                mask=mask.expand_dims(pixel=pixel),
+                name=name,
+            )
+            label_map[:, variable.labels.values[mask.values]] = batch_variable.labels.values[
+                :, mask.values
+            ]
+
+        def to_batch_expression(term_vars, term_coeffs):
+            batch_vars = np.where(term_vars.values == -1, -1, label_map[:, term_vars.values])
+            term_vars = term_vars.expand_dims(pixel=pixel).copy(data=batch_vars)
+            if "pixel" not in term_coeffs.dims:
+                term_coeffs = term_coeffs.expand_dims(pixel=pixel)
+            return linopy.LinearExpression(
+                xr.Dataset({"coeffs": term_coeffs, "vars": term_vars}), model
+            )
+
+        for name in template.constraints:
+            constraint = template.constraints[name]
+            lhs = to_batch_expression(*self._terms(name, input_profiles))
+            model.add_constraints(
+                lhs.to_constraint(
+                    constraint.sign.expand_dims(pixel=pixel),
+                    constraint.rhs.expand_dims(pixel=pixel),
+                ),
+                mask=(constraint.labels != -1).expand_dims(pixel=pixel),
+                name=name,
+            )
+
+        objective = template.objective.expression
+        pixel_objective = (
+            to_batch_expression(objective.vars, objective.coeffs).sum(objective.vars.dims)
+            + objective.const
+        )
+        model.add_objective(pixel_objective.sum(), sense=template.objective.sense)
+
+        return model, pixel_objective
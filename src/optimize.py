@@ -1,23 +1,46 @@
-import re
-import io
+import os
 import time
 import logging
+import multiprocessing
 from contextlib import redirect_stdout
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+import pandas as pd
 import xarray as xr
 
 from src.util import create_folder
+from src.util import serpentine_order
+from src.util import iter_chunk_indices
+from src.util import land_chunk_indices
+from src.util import resample_mean
+from src.util import group_profiles
 
 from src.task import task
 
 from src import snakemake_config
+from src.paths import LOG_FILE
 
 from src.load_data import load_pv
 from src.load_data import load_wind
-from src.load_data import load_land_sea_mask
+from src.load_data import load_grid
+from src.load_data import load_land_mask
+from src.load_data import load_timeseries_chunk
 
 from src.methanol_network import create_methanol_network
+from src.network_template import NetworkTemplate
+from src.pixel_checkpoint import PixelCheckpoint
+from src.result_cache import ResultCache
+from src.result_cache import code_version
+from src.result_cache import evict_result_cache
+
+from src.representative_periods import select_representative_periods
+
+from src.solver import METHODS
+from src.solver import WarmStart
+from src.solver import solve_direct
+from src.solver import solver_statistics
 
 from src.model_parameters import pv_cost
 from src.model_parameters import wind_cost
@@ -32,10 +55,34 @@ from src.model_parameters import methanol_synthesis_convert_factor
 from src.model_parameters import methanol_synthesis_input_proportions
 
 
+# statistics of the solver saved for each pixel, see solver_statistics()
+SOLVER_STATS_VARS = [
+    "runtime_solver",
+    "simplex_iterations",
+    "barrier_iterations",
+    "method",
+    "solver_status",
+    "objective",
+    "num_rows",
+    "num_cols",
+    "num_nonzeros",
+]
+
+# if pixels are optimized in batches, these are values of the whole LP divided by the number of
+# pixels, see optimize_pixel_batch()
+BATCH_AVERAGED_VARS = [
+    "runtime",
+    "runtime_solver",
+    "simplex_iterations",
+    "barrier_iterations",
+    "num_rows",
+    "num_cols",
+    "num_nonzeros",
+]
+
 # variables to be saved in the final NetCDF file
 OUTPUT_VARS = [
     "runtime",
-    "runtime_solver",
     "size_solar_pv",
     "size_wind",
     "size_storage_electricity",
@@ -45,11 +92,86 @@ OUTPUT_VARS = [
     "size_co2",
     "size_storage_methanol_synthesis",
     "size_methanol_synthesis",
-]
+] + SOLVER_STATS_VARS
+
+# measured when a pixel is optimized, NaN for pixels which are not optimized in the current run but
+# taken from the result cache or copied from another pixel (deduplication), i.e. run times from a
+# previous run or of another pixel are not used by the scheduler as if they were measured
+MEASURED_VARS = ["runtime"] + [name for name in SOLVER_STATS_VARS if name != "objective"]
+
+# parameters passed to create_methanol_network(), everything except the input profiles
+MODEL_PARAMS = {
+    "pv_cost": pv_cost,
+    "wind_cost": wind_cost,
+    "methanol_demand": methanol_demand,
+    "storage_params": storage_params,
+    "co2_cost": co2_cost,
+    "co2_convert_factor": co2_convert_factor,
+    "electrolizer_cost": electrolizer_cost,
+    "electrolizer_convert_factor": electrolizer_convert_factor,
+    "methanol_synthesis_cost": methanol_synthesis_cost,
+    "methanol_synthesis_convert_factor": methanol_synthesis_convert_factor,
+    "methanol_synthesis_input_proportions": methanol_synthesis_input_proportions,
+}
+
+
+def get_solver_params(solver_name, solver_params=None):
+    """Merge the default parameters for the solver from the config with ``solver_params``."""
+    solver_defaults = snakemake_config.config["solver_params"].get(solver_name, {})
+    solver_params = {} if solver_params is None else solver_params
+
+    return {**solver_defaults, **solver_params}
+
+
+def solve_model(model, optimize, solver_name, solver_params=None, warmstart=None):
+    """Solve the linopy model ``model`` using default parameters for the solver from the config
+    and return statistics of the solver (see solver_statistics()).
+
+    If the solver parameter io_api is set to "direct" or if warmstart is not None, the model is
+    passed to the solver in memory (see solve_direct()). Otherwise
+    ``optimize(solver_name=solver_name, **solver_params)`` is called, i.e. linopy writes the model
+    to a file in solver_dir.
+
+    """
+    solver_params = get_solver_params(solver_name, solver_params)
+
+    # The log output of the solver is discarded, all relevant numbers are in the statistics.
+    # Parsing (and even only capturing) the log output takes time.
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        if warmstart is None and solver_params.get("io_api") != "direct":
+            t0 = time.time()
+            optimize(solver_name=solver_name, **solver_params)
+            runtime_linopy = time.time() - t0
+
+            stats = solver_statistics(solver_name, model.solver_model)
+            if np.isnan(stats["runtime_solver"]):
+                # not provided by cplex, the best we can do here is to include the time needed by
+                # linopy to write the model and read the solution
+                stats["runtime_solver"] = runtime_linopy
+        else:
+            solver_params.pop("io_api", None)
+            stats = solve_direct(model, solver_name, warmstart=warmstart, **solver_params)
+
+    # NaN if the solver does not provide statistics
+    method = "unknown" if np.isnan(stats["method"]) else METHODS[stats["method"]]
+    logging.info(
+        f"Solver runtime: {stats['runtime_solver']}, method: {method}, "
+        f"simplex iterations: {stats['simplex_iterations']}, "
+        f"barrier iterations: {stats['barrier_iterations']}"
+    )
+
+    return stats
 
 
 def optimize_pixel(
-    wind_input_profile, pv_input_profile, model_file=None, solver_name=None, **solver_params
+    wind_input_profile,
+    pv_input_profile,
+    model_file=None,
+    solver_name=None,
+    network_template=None,
+    warmstart=None,
+    time_weights=None,
+    **solver_params,
 ):
     """Optimize one pixel.
 
@@ -64,8 +186,19 @@ def optimize_pixel(
         solvers, see documentation of linopy)
     solver_name : str
         name of solver, passed to linopy (e.g. gurobi, highs, cplex, ...)
+    network_template : NetworkTemplate
+        if not None, the network of the template is re-used and only the input profiles are
+        replaced instead of creating a new network
+    warmstart : WarmStart
+        if not None, the model is passed to the solver in memory (see solve_direct()) and the
+        solver is started from the previous solution stored in this object, which is then
+        replaced by the solution of this pixel; only useful together with network_template
+    time_weights : xr.DataArray
+        weight of each time step if the input profiles are representative periods (see
+        select_representative_periods()), ignored if network_template is given (the weights are
+        part of the template then)
     solver_params: dict
-        passed to linopy for solver
+        passed to the solver, io_api="direct" passes the model in memory (see solve_model())
 
     """
     if solver_name is None:
@@ -78,64 +211,111 @@ def optimize_pixel(
     # TODO model parameters should be packed into a named tuple or so and then passed to this
     # function as parameter
 
-    network = create_methanol_network(
-        pv_input_profile=pv_input_profile,
-        pv_cost=pv_cost,
-        wind_input_profile=wind_input_profile,
-        wind_cost=wind_cost,
-        methanol_demand=methanol_demand,
-        storage_params=storage_params,
-        co2_cost=co2_cost,
-        co2_convert_factor=co2_convert_factor,
-        electrolizer_cost=electrolizer_cost,
-        electrolizer_convert_factor=electrolizer_convert_factor,
-        methanol_synthesis_cost=methanol_synthesis_cost,
-        methanol_synthesis_convert_factor=methanol_synthesis_convert_factor,
-        methanol_synthesis_input_proportions=methanol_synthesis_input_proportions,
+    if network_template is None:
+        network = create_methanol_network(
+            pv_input_profile=pv_input_profile,
+            wind_input_profile=wind_input_profile,
+            time_weights=time_weights,
+            **MODEL_PARAMS,
+        )
+        logging.info(f"Creating network took {time.time() - t0}")
+    else:
+        network = network_template.update_input_profiles(
+            pv_input_profile=pv_input_profile,
+            wind_input_profile=wind_input_profile,
+        )
+        logging.info(f"Updating network template took {time.time() - t0}")
+
+    stats = solve_model(
+        network.model,
+        network.optimize,
+        solver_name,
+        solver_params,
+        warmstart=warmstart,
     )
 
-    logging.info(f"Creating network took {time.time() - t0}")
+    solution = network.model.solution
 
-    solver_defaults = snakemake_config.config["solver_params"]
+    for name in SOLVER_STATS_VARS:
+        solution[name] = stats[name]
+    solution["runtime"] = time.time() - t0
 
-    if solver_name in solver_defaults:
-        solver_params = {**solver_defaults[solver_name], **solver_params}
+    solution = solution.expand_dims(x=pv_input_profile.x, y=pv_input_profile.y)
 
-    with io.StringIO() as buf, redirect_stdout(buf):
-        network.optimize(
-            solver_name=solver_name,
-            **solver_params,
-        )
-        # XXX do we need the optimizer's log output?
-        output = buf.getvalue()
+    return solution, network
 
-    logging.debug(f"Solver output: \n\n{output}")
 
-    solution = network.model.solution
+def optimize_pixel_batch(
+    wind_input_profiles,
+    pv_input_profiles,
+    network_template,
+    solver_name=None,
+    **solver_params,
+):
+    """Optimize multiple pixels at once in a single LP with one block per pixel, see
+    NetworkTemplate.create_batch_model(). This saves the overhead of solver start-up and
+    presolve for each pixel.
+
+    Parameters
+    ----------
+    wind_input_profiles : xr.DataArray
+        wind time series with dimensions pixel and time
+    pv_input_profiles : xr.DataArray
+        PV time series with dimensions pixel and time
+    network_template : NetworkTemplate
+        template used to create the model
+    solver_name : str
+        name of solver, passed to linopy (e.g. gurobi, highs, cplex, ...)
+    solver_params: dict
+        passed to the solver, io_api="direct" passes the model in memory (see solve_model())
+
+    Returns
+    -------
+    xr.Dataset
+        solution with all OUTPUT_VARS and dimension pixel (integer index in the same order as the
+        input profiles); BATCH_AVERAGED_VARS (runtime, runtime_solver, iterations and size of the
+        model) are averages per pixel, i.e. values of the single solve of the whole batch divided
+        by the number of pixels, method and solver_status are the same for all pixels of the batch
+
+    """
+    if solver_name is None:
+        solver_name = snakemake_config.config["solver"]
 
-    # Parse log output to get run time from solver.
-    patterns = (
-        # Gurobi (gurobipy might provide this value directly, but linopy does not pass it through)
-        r"Solved in \d+ iterations and ([0-9.]+) seconds \([0-9.]+ work units\)",
-        # Cplex
-        r"Total time on \d+ threads = ([0-9.]+) sec. \([0-9.]+ ticks\)",
+    num_pixels = pv_input_profiles.sizes["pixel"]
+
+    logging.info(f"Start optimization of {num_pixels} pixels...")
+
+    t0 = time.time()
+
+    model, pixel_objective = network_template.create_batch_model(
+        pv_input_profiles=pv_input_profiles,
+        wind_input_profiles=wind_input_profiles,
     )
-    for pattern in patterns:
-        output_match = re.search(pattern, output)
-        if output_match:
-            runtime_solver = float(output_match.group(1))
-            break
-    else:
-        # if the pattern is not found, let's simply ignore it...
-        runtime_solver = float("nan")
 
-    logging.info(f"Solver runtime: {runtime_solver}")
-    solution["runtime_solver"] = runtime_solver
-    solution["runtime"] = time.time() - t0
+    logging.info(f"Creating batch model took {time.time() - t0}")
 
-    solution = solution.expand_dims(x=pv_input_profile.x, y=pv_input_profile.y)
+    def optimize(solver_name, **solver_params):
+        model.solve(solver_name=solver_name, **solver_params)
+        if model.termination_condition != "optimal":
+            raise RuntimeError(
+                "unable to solve optimization of batch, termination condition: "
+                f"{model.termination_condition}"
+            )
 
-    return solution, network
+    stats = solve_model(model, optimize, solver_name, solver_params)
+
+    solution = model.solution
+
+    for name in SOLVER_STATS_VARS:
+        if name == "objective":
+            solution[name] = pixel_objective.solution
+        elif name in BATCH_AVERAGED_VARS:
+            solution[name] = stats[name] / num_pixels
+        else:
+            solution[name] = stats[name]
+    solution["runtime"] = (time.time() - t0) / num_pixels
+
+    return solution[OUTPUT_VARS]
 
 
 def optimize_pixel_by_coord(x, y, year, model_file=None, **solver_params):
@@ -157,6 +337,219 @@ def optimize_pixel_by_coord(x, y, year, model_file=None, **solver_params):
     )
 
 
+def load_chunk_input_profiles(
+    pv_timeseries_fname,
+    wind_timeseries_fname,
+    x_start_idx,
+    y_start_idx,
+    chunk_size,
+    time_period_h="1h",
+):
+    """Load PV and wind time series of a chunk of pixels and resample them to the time resolution
+    used for the optimization, unless the files have this resolution already.
+
+    Returns
+    -------
+    xr.Dataset
+        with data variables wind_input_profile and pv_input_profile and dims x, y, time
+
+    """
+    x_slice = slice(x_start_idx, x_start_idx + chunk_size[0])
+    y_slice = slice(y_start_idx, y_start_idx + chunk_size[1])
+
+    def slice_and_load(fname):
+        # input_profile is an xarray object with dims: x, y, time (NaN for sea pixels if the file
+        # contains land pixels only)
+        input_profile = load_timeseries_chunk(fname, x_slice, y_slice)
+
+        # the Snakefile passes time series which have been resampled already, see
+        # resample_renewable_timeseries()
+        time_step = input_profile.time.values[1] - input_profile.time.values[0]
+        if time_step != pd.Timedelta(time_period_h):
+            # this loads the xarray object, an additional load() takes only <1ms
+            # resample().mean() is pretty slow, this gives the same result much faster
+            input_profile = resample_mean(input_profile, time_period_h)
+
+        if snakemake_config.config["testmode"]:
+            # we need an equidistant time series without NaN values for syfop, but the test mode
+            # downloads crappy data so let's just throw away NaNs (introduced by the resampling
+            # above) and then use only two time stamps - they are equidistant.
+            input_profile = input_profile.dropna("time", how="all").isel(time=[0, 1])
+
+        return input_profile.load()
+
+    # note: this takes some while, that's why we do it only once for a chunk of pixels and not for
+    # each pixel.
+    wind_input_profile = slice_and_load(wind_timeseries_fname)
+    pv_input_profile = slice_and_load(pv_timeseries_fname)
+
+    return xr.Dataset(
+        {"wind_input_profile": wind_input_profile, "pv_input_profile": pv_input_profile}
+    )
+
+
+def chunk_land_pixels(param, min_land_fraction=0.0):
+    """Return the indices (x_idx, y_idx) of all land pixels of a chunk (see load_land_mask()).
+
+    Neighbouring pixels are optimized one after another, because their solutions are similar (good
+    for the warm start), so pixels are returned in serpentine order (see serpentine_order()).
+
+    """
+    is_land = load_land_mask(min_land_fraction).sel(x=param.x, y=param.y).values
+    return [
+        (x_idx, y_idx) for x_idx, y_idx in serpentine_order(*is_land.shape) if is_land[x_idx, y_idx]
+    ]
+
+
+def group_pixels(param, pixels, tolerance=None):
+    """Group pixels of a chunk with the same input profiles (PV and wind), only one pixel of each
+    group needs to be optimized. Pixels have the same input profiles e.g. at high latitudes (no PV
+    for long periods and the same wind after resampling) or at the edges of the grid. See
+    group_profiles() for ``tolerance`` and the return values, indices refer to ``pixels``."""
+    if not pixels:
+        return np.array([], dtype=int), np.array([])
+
+    x_idcs, y_idcs = (list(idcs) for idcs in zip(*pixels))
+    profiles = np.concatenate(
+        [
+            param[name].transpose("x", "y", "time").values[x_idcs, y_idcs]
+            for name in ("pv_input_profile", "wind_input_profile")
+        ],
+        axis=1,
+    )
+    return group_profiles(profiles, tolerance)
+
+
+def _create_output_dataset(solutions, x, y, batch_size=1):
+    """Create the Dataset stored in the output files from an array with shape
+    (len(OUTPUT_VARS), len(x), len(y)). If ``batch_size`` > 1, the BATCH_AVERAGED_VARS are marked
+    as averages per pixel of a batch."""
+    out = xr.Dataset(
+        {name: (("x", "y"), solution) for name, solution in zip(OUTPUT_VARS, solutions)},
+        coords={"x": x, "y": y},
+    )
+
+    # CF convention for categorical values
+    out["method"].attrs["flag_values"] = list(range(len(METHODS)))
+    out["method"].attrs["flag_meanings"] = " ".join(METHODS)
+    out["solver_status"].attrs["comment"] = "status code of the solver, depends on the solver"
+
+    if batch_size > 1:
+        for name in BATCH_AVERAGED_VARS:
+            out[name].attrs["comment"] = (
+                f"average per pixel: value of a batch of up to {batch_size} pixels optimized in a "
+                "single LP divided by the number of pixels of the batch"
+            )
+
+    return out
+
+
+def model_context():
+    """Return a string describing the solver and parameters of the config and MODEL_PARAMS, i.e.
+    everything which affects the result of a pixel except its input profiles and the code
+    version."""
+    solver_name = snakemake_config.config["solver"]
+    return (
+        f"solver={solver_name} solver_params={get_solver_params(solver_name)!r} "
+        f"model_params={MODEL_PARAMS!r} variables={OUTPUT_VARS}"
+    )
+
+
+def create_result_cache(cache_dir):
+    """Return a ResultCache for the results of pixels optimized with the solver and parameters of
+    the config and MODEL_PARAMS."""
+    return ResultCache(cache_dir, model_context())
+
+
+def pixel_cache_key(cache, param, x_idx, y_idx):
+    """Return the key of a pixel of a chunk in the result cache: the input profiles, the time
+    steps and (for representative periods) the weights of the time steps."""
+    param_pixel = param.isel(x=x_idx, y=y_idx)
+    arrays = [
+        param_pixel.wind_input_profile.values,
+        param_pixel.pv_input_profile.values,
+        param.time.values,
+    ]
+    if "time_weight" in param:
+        arrays.append(param.time_weight.values)
+    return cache.key(*arrays)
+
+
+# state of the process optimizing pixels of a chunk, see _init_worker()
+_worker = {}
+
+
+def _init_worker(param, reuse_network, batch_size, warmstart):
+    """Prepare a process (a worker of the process pool or the main process if num_workers=1) to
+    optimize pixels of a chunk with _optimize_pixels().
+
+    Each process needs its own network template and warm start, because the linopy model is
+    modified for each pixel.
+
+    """
+    network_template = None
+    if reuse_network or batch_size > 1:
+        t0 = time.time()
+        network_template = NetworkTemplate(
+            time_coords=param.time, time_weights=param.get("time_weight"), **MODEL_PARAMS
+        )
+        logging.info(f"Creating network template took {time.time() - t0}")
+
+    if warmstart and batch_size == 1:
+        if network_template is None:
+            raise ValueError("warmstart requires reuse_network=True")
+        warmstart = WarmStart()
+    else:
+        warmstart = None
+
+    _worker["param"] = param.drop_vars(("lon", "lat"), errors="ignore")
+    _worker["batch_size"] = batch_size
+    _worker["network_template"] = network_template
+    _worker["warmstart"] = warmstart
+
+
+def _optimize_pixels(pixel_indices):
+    """Optimize the pixels of a chunk given as list of index tuples (x_idx, y_idx), at once in a
+    single LP if batch_size > 1. Returns an array of shape (len(OUTPUT_VARS), len(pixel_indices))
+    with the values of all OUTPUT_VARS for each pixel."""
+    param = _worker["param"]
+
+    if _worker["batch_size"] > 1:
+        logging.info(f"Computing batch of {len(pixel_indices)} pixels...")
+        param_batch = xr.concat(
+            [param.isel(x=x_idx, y=y_idx) for x_idx, y_idx in pixel_indices], dim="pixel"
+        )
+        solution = optimize_pixel_batch(
+            wind_input_profiles=param_batch.wind_input_profile,
+            pv_input_profiles=param_batch.pv_input_profile,
+            network_template=_worker["network_template"],
+        )
+        return solution[OUTPUT_VARS].to_array().transpose("variable", "pixel").values
+
+    solutions = np.full((len(OUTPUT_VARS), len(pixel_indices)), np.nan)
+    for pixel_idx, (x_idx, y_idx) in enumerate(pixel_indices):
+        param_pixel = param.isel(x=[x_idx], y=[y_idx])
+        pixel_name = f"{param_pixel.x.item()}/{param_pixel.y.item()}"
+
+        t0 = time.time()
+        logging.info(f"Computing pixel {pixel_name}...")
+
+        solution, _ = optimize_pixel(
+            wind_input_profile=param_pixel.wind_input_profile,
+            pv_input_profile=param_pixel.pv_input_profile,
+            network_template=_worker["network_template"],
+            warmstart=_worker["warmstart"],
+            time_weights=param.get("time_weight"),
+        )
+
+        solutions[:, pixel_idx] = [solution[name].item() for name in OUTPUT_VARS]
+
+        runtime = time.time() - t0
+        logging.info(f"Pixel runtime for pixel {pixel_name} took: {runtime}s")
+
+    return solutions
+
+
 @task
 def optimize_network_chunk(
     x_start_idx,
@@ -165,12 +558,23 @@ def optimize_network_chunk(
     pv_timeseries_fname,
     wind_timeseries_fname,
     time_period_h="1h",
+    reuse_network=False,
+    batch_size=1,
+    warmstart=False,
+    num_workers=1,
+    resume=True,
+    representative_periods=None,
+    period_length_h=24,
+    min_land_fraction=0.0,
+    result_cache_dir=None,
+    deduplicate=True,
+    deduplicate_tolerance=None,
     inputs=None,
     outputs=None,
 ):
-    """This function computes the result for a chunk of pixels in a simple for-loop and stores the
-    result in a single NetCDF file. Multiple instances of this function can be run in parallel in
-    separate processes.
+    """This function computes the result for a chunk of pixels and stores the result in a single
+    NetCDF file. Multiple instances of this function can be run in parallel in separate processes,
+    but pixels of a chunk can also be optimized in parallel (see num_workers).
 
     Parameters
     ----------
@@ -181,6 +585,42 @@ def optimize_network_chunk(
     time_period_h : str
         time resolution, '1h' will leave input unchanged (=this is a runtime performance), see
         xarray.DataArray.resample() for other possible values
+    reuse_network : bool
+        if True, the network is created only once for the whole chunk and only the input profiles
+        are replaced for each pixel (see NetworkTemplate), otherwise a new network is created for
+        each pixel
+    batch_size : int
+        number of pixels optimized at once in a single LP (see optimize_pixel_batch()), 1 means
+        that each pixel is optimized separately; larger batches need more memory
+    warmstart : bool
+        if True, each pixel is warm started from the solution of the previously optimized pixel
+        (see WarmStart), requires reuse_network; ignored if batch_size > 1
+    num_workers : int
+        number of processes optimizing pixels of the chunk in parallel, 1 means that all pixels
+        are optimized one after another in the current process
+    resume : bool
+        if True, results of each pixel are stored in a checkpoint file next to the output file
+        immediately and pixels found in the checkpoint file of a previous (killed) run are not
+        optimized again, see PixelCheckpoint
+    representative_periods : int
+        if not None, the time series are reduced to this number of representative periods of
+        period_length_h hours, selected for all land pixels of the chunk at once (see
+        select_representative_periods())
+    period_length_h : int
+        length of a representative period in hours
+    min_land_fraction : float
+        only pixels with a larger land fraction are optimized, see load_land_mask()
+    result_cache_dir : str
+        if not None, results of pixels are looked up in (and added to) the ResultCache in this
+        folder, pixels with the same input profiles and parameters are not optimized again and
+        their MEASURED_VARS (run time and solver statistics) are NaN in the output
+    deduplicate : bool
+        if True, land pixels with the same input profiles are optimized only once and the
+        solution is copied to the other pixels of the group (except MEASURED_VARS, which are
+        NaN), see group_pixels()
+    deduplicate_tolerance : float
+        if not None, pixels with input profiles differing by at most this value are grouped too,
+        i.e. their solution is approximated by the solution of another pixel
 
     """
     logger = logging.getLogger(f"optimization_{x_start_idx}_{y_start_idx}")
@@ -190,95 +630,276 @@ def optimize_network_chunk(
 
     t0 = time.time()
 
-    x_slice = slice(x_start_idx, x_start_idx + chunk_size[0])
-    y_slice = slice(y_start_idx, y_start_idx + chunk_size[1])
+    param = load_chunk_input_profiles(
+        pv_timeseries_fname=pv_timeseries_fname,
+        wind_timeseries_fname=wind_timeseries_fname,
+        x_start_idx=x_start_idx,
+        y_start_idx=y_start_idx,
+        chunk_size=chunk_size,
+        time_period_h=time_period_h,
+    )
 
-    def slice_and_load(fname):
-        # input_profile is an xarray object with dims: x, y, time
-        input_profile = xr.open_dataarray(fname)
-        input_profile = input_profile.isel(x=x_slice, y=y_slice)
-        if time_period_h != "1h":
-            # this seems to load() the xarray object, but an additional load() takes only <1ms
-            input_profile = input_profile.resample(time=time_period_h).mean()
-
-            # resample().mean() is pretty slow, also in comparison to load()
-            # This is a faster alternative, which selects every second hour:
-            # input_profile.sel(time=slice(None, None, 2))
-            # But for a 5x5 chunk, the speed up is only about 600ms. Probably not worth it.
+    logging.info(f"Loading time series files took {time.time() - t0}")
 
-        if snakemake_config.config["testmode"]:
-            # we need an equidistant time series without NaN values for syfop, but the test mode
-            # downloads crappy data so let's just throw away NaNs (introduced by the resampling
-            # above) and then use only two time stamps - they are equidistant.
-            input_profile = input_profile.dropna("time").isel(time=[0, 1])
+    # exclude pixels which are fully covered by sea area...
+    land_pixels = chunk_land_pixels(param, min_land_fraction)
 
-        return input_profile.load()
+    num_pixels = param.sizes["x"] * param.sizes["y"]
+    logger.info(
+        f"Skipping {num_pixels - len(land_pixels)} of {num_pixels} pixels not on land area for "
+        f"chunk {x_start_idx},{y_start_idx}..."
+    )
 
-    # note: this takes some while, that's why we do it only once for a chunk of pixels and not for
-    # each pixel.
-    wind_input_profile = slice_and_load(wind_timeseries_fname)
-    pv_input_profile = slice_and_load(pv_timeseries_fname)
+    if representative_periods is not None and land_pixels:
+        param = select_representative_periods(
+            param, representative_periods, period_length_h, pixels=land_pixels
+        )
+
+    num_land_pixels = len(land_pixels)
+
+    # pixels with the same input profiles as another pixel are not optimized, their solution is
+    # copied from the representative of their group at the end
+    duplicates = {}
+    if deduplicate:
+        representatives, max_abs_diff = group_pixels(param, land_pixels, deduplicate_tolerance)
+        duplicates = {
+            pixel: land_pixels[representative]
+            for pixel, representative in zip(land_pixels, representatives)
+            if land_pixels[representative] != pixel
+        }
+        message = (
+            f"Deduplication: {len(duplicates)} of {len(land_pixels)} land pixels have the same "
+            "input profiles as another pixel"
+        )
+        if deduplicate_tolerance is not None:
+            message += (
+                f" (tolerance {deduplicate_tolerance}, max absolute difference of the profiles: "
+                f"{max_abs_diff.max(initial=0.0)})"
+            )
+        logger.info(message)
+        land_pixels = [pixel for pixel in land_pixels if pixel not in duplicates]
+
+    worker_params = {
+        "param": param,
+        "reuse_network": reuse_network,
+        "batch_size": batch_size,
+        "warmstart": warmstart,
+    }
+
+    # results of all pixels, sea pixels remain NaN
+    solutions = np.full((len(OUTPUT_VARS), param.sizes["x"], param.sizes["y"]), np.nan)
+    measured_idcs = [OUTPUT_VARS.index(name) for name in MEASURED_VARS]
+
+    checkpoint = None
+    if resume:
+        # all parameters which affect the results of the pixels, a checkpoint of a run with
+        # different parameters is not used
+        checkpoint_id = (
+            f"chunk={x_start_idx},{y_start_idx} chunk_size={chunk_size} "
+            f"time_period_h={time_period_h} min_land_fraction={min_land_fraction} "
+            f"representative_periods={representative_periods} period_length_h={period_length_h} "
+            f"{model_context()} code={code_version()} "
+            + " ".join(
+                f"{fname}@{os.path.getmtime(fname)}"
+                for fname in (pv_timeseries_fname, wind_timeseries_fname)
+            )
+        )
+        checkpoint = PixelCheckpoint(f"{outputs[0]}.checkpoint", OUTPUT_VARS, checkpoint_id)
+        finished_pixels = checkpoint.load()
+        for (x_idx, y_idx), values in finished_pixels.items():
+            solutions[:, x_idx, y_idx] = values
+
+        if finished_pixels:
+            logger.info(
+                f"Resuming: {len(finished_pixels)} of {len(land_pixels)} land pixels found in "
+                "checkpoint file"
+            )
+        land_pixels = [pixel for pixel in land_pixels if pixel not in finished_pixels]
+
+    # pixels with the same input profiles have been optimized already, e.g. in an overlapping region
+    # or for another renewable scenario
+    cache = None
+    if result_cache_dir is not None:
+        cache = create_result_cache(result_cache_dir)
+        cache_keys = {pixel: pixel_cache_key(cache, param, *pixel) for pixel in land_pixels}
+        cached_pixels = set()
+        for (x_idx, y_idx), key in cache_keys.items():
+            values = cache.get(key)
+            if values is not None:
+                solutions[:, x_idx, y_idx] = values
+                solutions[measured_idcs, x_idx, y_idx] = np.nan
+                cached_pixels.add((x_idx, y_idx))
+        land_pixels = [pixel for pixel in land_pixels if pixel not in cached_pixels]
+        logger.info(
+            f"Result cache: {len(cached_pixels)} land pixels found, {len(land_pixels)} to be "
+            "optimized"
+        )
 
-    land_sea_mask = load_land_sea_mask().load()
+    # each task is a list of pixels which are optimized at once, a single pixel if batch_size == 1
+    pixel_tasks = [
+        land_pixels[start : start + batch_size] for start in range(0, len(land_pixels), batch_size)
+    ]
+
+    def store_solutions(pixel_indices, pixel_solutions):
+        x_idcs, y_idcs = zip(*pixel_indices)
+        solutions[:, x_idcs, y_idcs] = pixel_solutions
+        if checkpoint is not None:
+            for pixel_idx, pixel in enumerate(pixel_indices):
+                checkpoint.append(pixel, pixel_solutions[:, pixel_idx])
+        if cache is not None:
+            for pixel_idx, pixel in enumerate(pixel_indices):
+                cache.put(cache_keys[pixel], pixel_solutions[:, pixel_idx])
+
+    if not pixel_tasks:
+        # no need to create a network template
+        logger.info("All land pixels found in checkpoint file or result cache")
+    elif num_workers == 1:
+        _init_worker(**worker_params)
+        for pixel_task in pixel_tasks:
+            store_solutions(pixel_task, _optimize_pixels(pixel_task))
+    else:
+        logger.info(f"Optimizing {len(land_pixels)} land pixels with {num_workers} workers...")
+        # The input profiles are passed to each worker only once when the worker is started (not
+        # for each task), tasks are only lists of pixel indices. Workers are started with spawn
+        # instead of fork (default on Linux): the solver might have been used in this process
+        # already and forking a process with running threads (e.g. of HiGHS) can deadlock.
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=snakemake_config.init_spawned_process,
+            initargs=(
+                snakemake_config.config,
+                LOG_FILE,
+                __name__,
+                "_init_worker",
+                *worker_params.values(),
+            ),
+        ) as executor:
+            futures = {
+                executor.submit(_optimize_pixels, pixel_task): pixel_task
+                for pixel_task in pixel_tasks
+            }
+            for future in as_completed(futures):
+                store_solutions(futures[future], future.result())
+
+    for (x_idx, y_idx), (x_idx_representative, y_idx_representative) in duplicates.items():
+        solutions[:, x_idx, y_idx] = solutions[:, x_idx_representative, y_idx_representative]
+        solutions[measured_idcs, x_idx, y_idx] = np.nan
+
+    out = _create_output_dataset(
+        solutions, x=param.x.values, y=param.y.values, batch_size=batch_size
+    )
 
-    logging.info(f"Loading time series files took {time.time() - t0}")
+    create_folder("network_solution")
+    # write to a temporary file first, a work unit checks if the output file exists
+    out.to_netcdf(f"{outputs[0]}.tmp")
+    os.replace(f"{outputs[0]}.tmp", outputs[0])
 
-    # this makes the for loop easier
-    param = xr.Dataset(
-        {"wind_input_profile": wind_input_profile, "pv_input_profile": pv_input_profile}
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    logger.info(
+        f"Optimized {len(land_pixels)} of {num_land_pixels} land pixels, "
+        f"solves saved: {num_land_pixels - len(land_pixels)}"
     )
+    logger.info(f"Chunk {x_start_idx},{y_start_idx} done!")
+
 
-    i = 0
-    solutions = []
+@task
+def optimize_work_unit(
+    work_units_fname,
+    work_unit,
+    chunk_fname_pattern,
+    inputs=None,
+    outputs=None,
+    **chunk_params,
+):
+    """Optimize all chunks of a work unit one after another, see create_work_units().
 
-    # XXX no idea if groupby is really the best option to loop through two dimensions, but it seems
-    # to work for now.
+    Parameters
+    ----------
+    work_units_fname : str
+        CSV file written by create_work_units()
+    work_unit : int
+        index of the work unit
+    chunk_fname_pattern : str
+        output file name of a chunk, formatted with x_idx and y_idx
+    chunk_params : kwargs
+        passed to optimize_network_chunk()
 
-    # the number of pixel in the chunk we are processing here
-    num_pixels = param.sizes["x"] * param.sizes["y"]
+    """
+    work_units = pd.read_csv(work_units_fname)
+    chunks = work_units[work_units.work_unit == work_unit]
 
-    for param_x_coord, param_x in param.groupby("x"):
-        for param_y_coord, param_y in param_x.groupby("y"):
-            i += 1
-            # exclude pixels which are fully covered by sea area...
-            pixel_name = (
-                f"pixel {param_x_coord}/{param_y_coord} (number {i}/{num_pixels}) "
-                f"for chunk {x_start_idx},{y_start_idx}"
-            )
-            if land_sea_mask.sel(longitude=param_x_coord, latitude=param_y_coord) == 0.0:
-                logger.info(f"Skipping because not on land area: {pixel_name}...")
-                # adding empty solutions should make merging easier
-                emtpy_solution = xr.Dataset({k: np.nan for k in OUTPUT_VARS})
-                emtpy_solution = emtpy_solution.expand_dims(x=[param_x_coord], y=[param_y_coord])
-                solutions.append(emtpy_solution)
-                continue
+    logging.info(
+        f"Starting work unit {work_unit} with {len(chunks)} chunks, estimated run time: "
+        f"{chunks.estimated_runtime.sum()}"
+    )
 
-            t0 = time.time()
-            logger.info(f"Computing {pixel_name}...")
+    chunk_fnames = []
+    for x_idx, y_idx in zip(chunks.x_idx, chunks.y_idx):
+        chunk_fname = chunk_fname_pattern.format(x_idx=x_idx, y_idx=y_idx)
+        chunk_fnames.append(chunk_fname)
+
+        # the chunk has been finished already in a previous run of this work unit
+        if os.path.exists(chunk_fname):
+            continue
+
+        optimize_network_chunk(
+            inputs=inputs,
+            outputs=[chunk_fname],
+            x_start_idx=x_idx,
+            y_start_idx=y_idx,
+            **chunk_params,
+        )
 
-            param = param_y.expand_dims(x=1, y=1).drop_vars(("lon", "lat"))
+    with open(outputs[0], "w") as f:
+        f.write("".join(f"{chunk_fname}\n" for chunk_fname in chunk_fnames))
 
-            solution, _ = optimize_pixel(
-                wind_input_profile=param.wind_input_profile,
-                pv_input_profile=param.pv_input_profile,
-            )
 
-            solutions.append(solution[OUTPUT_VARS])
+@task
+def create_land_chunk_index(
+    x_idx_from_to, y_idx_from_to, chunk_size, min_land_fraction=0.0, inputs=None, outputs=None
+):
+    """Write the start indices of all chunks with at least one land pixel to a CSV file. Only these
+    chunks are optimized, see the checkpoint land_chunk_index in the Snakefile."""
+    is_land = load_land_mask(min_land_fraction)
 
-            runtime = time.time() - t0
-            logging.info(
-                f"Pixel runtime for pixel {param_x_coord}/{param_y_coord} took: {runtime}s"
-            )
+    chunk_indices = land_chunk_indices(is_land, x_idx_from_to, y_idx_from_to, chunk_size)
 
-    # TODO check if xr.concat() would be faster (supports only one dimension)
-    out = xr.combine_by_coords(solutions)
+    num_chunks = len(iter_chunk_indices(x_idx_from_to, y_idx_from_to, chunk_size))
+    logging.info(f"{len(chunk_indices)} of {num_chunks} chunks contain land pixels")
 
-    create_folder("network_solution")
-    out.to_netcdf(outputs[0])
-    logger.info(f"Chunk {x_start_idx},{y_start_idx} done!")
+    chunk_indices = pd.DataFrame(chunk_indices, columns=["x_idx", "y_idx"])
+    chunk_indices.to_csv(outputs[0], index=False)
 
 
 @task
-def concat_solution_chunks(inputs, outputs):
-    out = xr.open_mfdataset(inputs)
+def concat_solution_chunks(
+    x_idx_from_to,
+    y_idx_from_to,
+    result_cache_dir=None,
+    result_cache_max_size_gb=10.0,
+    inputs=None,
+    outputs=None,
+):
+    """Concatenate the solutions of all chunks to a single file for all pixels in
+    x_idx_from_to/y_idx_from_to. Chunks without land pixels are not optimized at all (see
+    create_land_chunk_index()), they are filled with NaN here. If result_cache_dir is not None,
+    the result cache is reduced to result_cache_max_size_gb, see evict_result_cache()."""
+    x, y = load_grid()
+    x, y = x[slice(*x_idx_from_to)], y[slice(*y_idx_from_to)]
+
+    out = _create_output_dataset(np.full((len(OUTPUT_VARS), len(x), len(y)), np.nan), x=x, y=y)
+
+    for fname in inputs:
+        chunk = xr.load_dataset(fname)
+        for name in OUTPUT_VARS:
+            out[name].loc[{"x": chunk.x, "y": chunk.y}] = chunk[name].transpose("x", "y").values
+            # e.g. the comment for BATCH_AVERAGED_VARS, see _create_output_dataset()
+            out[name].attrs.update(chunk[name].attrs)
+
     out.to_netcdf(outputs[0])
+
+    if result_cache_dir is not None:
+        evict_result_cache(result_cache_dir, result_cache_max_size_gb)
@@ -0,0 +1,75 @@
+import os
+import logging
+
+import numpy as np
+
+
+class PixelCheckpoint:
+    """Stores results of single pixels in a text file right after they have been optimized, so
+    that a chunk which has been killed (e.g. time limit or out of memory on the cluster) can be
+    resumed without optimizing all pixels again.
+
+    Each line contains the pixel indices and the values of all variables of one pixel. Lines are
+    only appended, a line which has been written only partially (because the process has been
+    killed while writing) is ignored when loading the file.
+
+    Parameters
+    ----------
+    fname : str
+        path of the checkpoint file
+    variables : list of str
+        names of the variables stored for each pixel
+    checkpoint_id : str
+        describes all parameters which affect the results (single line), a checkpoint file with a
+        different ID is not used
+
+    """
+
+    def __init__(self, fname, variables, checkpoint_id):
+        self.fname = fname
+        self.header = [f"# {checkpoint_id}", ",".join(["x_idx", "y_idx"] + list(variables))]
+        self._file = None
+
+    def load(self):
+        """Return a dict with pixel indices (x_idx, y_idx) as keys and an array with the values of
+        all variables as values for all pixels stored in the checkpoint file. The file is then
+        rewritten with these pixels only and ready to append new pixels."""
+        lines = []
+        if os.path.exists(self.fname):
+            with open(self.fname) as f:
+                lines = f.read().split("\n")
+
+        results = {}
+        if lines[: len(self.header)] == self.header:
+            # the last element is either empty or a line which has not been written completely
+            for line in lines[len(self.header) : -1]:
+                values = line.split(",")
+                results[int(values[0]), int(values[1])] = np.array(values[2:], dtype=float)
+        elif lines:
+            logging.warning(f"Ignoring checkpoint file with different parameters: {self.fname}")
+
+        self._file = open(self.fname, "w")
+        self._file.write("".join(f"{line}\n" for line in self.header))
+        for pixel_indices, values in results.items():
+            self._write(pixel_indices, values)
+        self._file.flush()
+
+        return results
+
+    def _write(self, pixel_indices, values):
+        line = ",".join([str(idx) for idx in pixel_indices] + [repr(float(v)) for v in values])
+        self._file.write(f"{line}\n")
+
+    def append(self, pixel_indices, values):
+        """Append results of a pixel to the checkpoint file, must be called after load()."""
+        self._write(pixel_indices, values)
+        # written to the OS, but without fsync() - it survives if the process is killed
+        self._file.flush()
+
+    def remove(self):
+        """Remove the checkpoint file, e.g. when all results have been stored elsewhere."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.fname):
+            os.remove(self.fname)
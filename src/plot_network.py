@@ -1,10 +1,10 @@
 import logging
-import xarray as xr
 
 import matplotlib.pyplot as plt
 
 from src.task import task
 
+from src.load_data import load_timeseries_chunk
 from src.methanol_network import create_methanol_network
 
 from src.model_parameters import pv_cost
@@ -30,8 +30,9 @@ def plot_network(
     logging.info(f"Plotting network...")
 
     logging.info(f"Loading time series...")
-    wind_input_profile = xr.open_dataarray(wind_timeseries_fname).isel(x=[0], y=[0])
-    pv_input_profile = xr.open_dataarray(pv_timeseries_fname).isel(x=[0], y=[0])
+    # the first pixel of the grid, works for compact time series files too
+    wind_input_profile = load_timeseries_chunk(wind_timeseries_fname, slice(0, 1), slice(0, 1))
+    pv_input_profile = load_timeseries_chunk(pv_timeseries_fname, slice(0, 1), slice(0, 1))
 
     logging.info(f"Creating network...")
     network = create_methanol_network(
@@ -1,11 +1,20 @@
 import logging
+import contextlib
+
+from types import SimpleNamespace
+from concurrent.futures import ProcessPoolExecutor
 
 import dask
+import atlite
+import atlite.convert
 import scipy
 import numpy as np
 import xarray as xr
 
 from src.task import task
+from src.util import resample_mean
+from src.util import land_pixel_indices
+from src.load_data import load_land_mask
 from src.download import create_era5_cutout
 
 
@@ -19,74 +28,480 @@ def unstack_to_xy(timeseries, cutout):
     return out
 
 
-def wind(cutout, params):
-    sparse_identity = scipy.sparse.identity(cutout.data.sizes["x"] * cutout.data.sizes["y"])
-    wind = cutout.wind(**params, matrix=sparse_identity)
-    wind = unstack_to_xy(wind, cutout)
-    return wind
+def convert_gridded(cutout, technology, params):
+    """Convert the cutout to capacity factors of ``technology`` ("pv" or "wind") on the native x/y
+    grid of the cutout, without aggregation matrix and without unstacking.
 
+    atlite's Cutout.pv() and Cutout.wind() either aggregate the converted grid (matrix, shapes,
+    layout) or sum it over time. Only the preparation of the parameters (panel, orientation,
+    turbine config...) of atlite.convert.pv() and atlite.convert.wind() is used here, the
+    conversion function is then applied to the cutout data and the result is returned as it is.
 
-def iterate_time_chunks(cutout, chunksize=None):
-    if chunksize is None:
-        # use chunks
-        chunksizes_time = cutout.data.chunksizes["time"]
-    else:
-        chunksizes_time = [chunksize] * (cutout.data.sizes["time"] // chunksize)
-        if cutout.data.sizes["time"] % chunksize != 0:
-            chunksizes_time.append(cutout.data.sizes["time"] % chunksize)
+    """
+
+    def convert_and_aggregate(convert_func, **convert_kwds):
+        return convert_func(cutout.data, **convert_kwds)
+
+    timeseries = getattr(atlite.convert, technology)(
+        SimpleNamespace(convert_and_aggregate=convert_and_aggregate), **params
+    )
+    timeseries = timeseries.rename("specific generation").transpose("time", "y", "x")
+    # same as for the aggregated time series
+    timeseries.attrs["units"] = "MW"
+    return timeseries
 
-    chunk_idx_start = 0
-    for chunk_idx_end in np.cumsum(chunksizes_time):
-        chunk_time = cutout.data.time.isel(time=slice(chunk_idx_start, chunk_idx_end))
-        cutout_chunk = cutout.sel(time=chunk_time)
-        yield cutout_chunk
-        chunk_idx_start = chunk_idx_end
 
+def convert(cutout, technology, params, gridded=True):
+    """Convert the cutout to capacity factors of ``technology`` ("pv" or "wind") with dimensions
+    time, y and x. If gridded is False, atlite aggregates the grid with an identity matrix and the
+    result is unstacked to x/y again (slower, needs more memory and fails if the cutout has
+    multiple dask chunks in x/y), see convert_gridded() otherwise."""
+    if gridded:
+        return convert_gridded(cutout, technology, params)
 
-def pv(cutout, params):
     sparse_identity = scipy.sparse.identity(cutout.data.sizes["x"] * cutout.data.sizes["y"])
+    timeseries = getattr(cutout, technology)(**params, matrix=sparse_identity)
+    return unstack_to_xy(timeseries, cutout)
+
+
+def tile_selection(cutout, tile, num_tiles):
+    """Selection of a tile of the cutout for Cutout.sel(). The grid is split into num_tiles[0]
+    times num_tiles[1] tiles of (almost) equal size in x and y, ``tile`` is a tuple of the tile
+    indices in x and y."""
+    selection = {}
+    for dim, tile_idx, num_dim_tiles in zip(("x", "y"), tile, num_tiles):
+        coords = cutout.data[dim].values
+        bounds = np.linspace(0, len(coords), num_dim_tiles + 1).astype(int)
+        selection[dim] = slice(coords[bounds[tile_idx]], coords[bounds[tile_idx + 1] - 1])
+    return selection
+
+
+def wind(cutout, params, gridded=True):
+    return convert(cutout, "wind", params, gridded=gridded)
+
+
+# largest value of uint16 used for capacity factors, the next one is the fill value for NaN
+UINT16_MAX_VALUE = 65534
+
+
+def encode_values(timeseries, dtype="float64", max_value=1.5, compression=None, complevel=1):
+    """Prepare a time series of capacity factors for writing with the encoding configured in
+    timeseries_encoding (see config/config.yaml).
+
+    Parameters
+    ----------
+    timeseries : xr.DataArray
+    dtype : str
+        "float64" (values as computed), "float32" or "uint16": values are stored as integers scaled
+        to [0, max_value], i.e. with an absolute error of at most max_value / 65534 / 2
+    max_value : float
+        largest value stored with dtype uint16, larger values are clipped (PV capacity factors can
+        be a bit larger than 1)
+    compression : str
+        None, "zlib" or any other compression supported by netCDF4-python (e.g. "zstd", needs the
+        HDF5 filter plugins), always with shuffle filter
+    complevel : int
+        compression level, low levels are much faster and compress almost as good
+
+    Returns
+    -------
+    timeseries : xr.DataArray
+        clipped to [0, max_value] for dtype uint16, otherwise unchanged
+    encoding : dict
+        NetCDF4 encoding of the values of the time series
+
+    """
+    encoding = {}
+    if dtype == "uint16":
+        timeseries = timeseries.clip(0.0, max_value, keep_attrs=True)
+        encoding.update(
+            dtype="uint16",
+            # float32 is precise enough for the scaled values and memory is halved when reading
+            scale_factor=np.float32(max_value / UINT16_MAX_VALUE),
+            add_offset=np.float32(0.0),
+            _FillValue=np.uint16(UINT16_MAX_VALUE + 1),
+        )
+    elif dtype != "float64":
+        encoding["dtype"] = dtype
+
+    if compression == "zlib":
+        encoding.update(zlib=True, complevel=complevel, shuffle=True)
+    elif compression is not None:
+        encoding.update(compression=compression, complevel=complevel, shuffle=True)
+
+    return timeseries, encoding
 
-    # TODO iterate through days in a loop or so because otherwise it requires too much RAM
 
-    pv_timeseries = []
-    for cutout_chunk in iterate_time_chunks(cutout, chunksize=48):
-        # t0 = time.time()
-        logging.info(f"Converting chunk {cutout_chunk.data.time[0].values}....")
+# Peak memory per pixel and time step when converting PV, measured 20.1GB for chunks of 48 hours of
+# the global grid on nora (atlite keeps quite a few intermediate arrays of the cutout size).
+PV_BYTES_PER_VALUE = 400
+
+
+def hours_per_chunk(cutout, max_memory_gb, num_workers=1):
+    """Number of time steps of the cutout converted at once by each worker such that all workers
+    together need roughly max_memory_gb, see PV_BYTES_PER_VALUE."""
+    num_pixels = cutout.data.sizes["x"] * cutout.data.sizes["y"]
+    hours = int(max_memory_gb * 1e9 / num_workers // (PV_BYTES_PER_VALUE * num_pixels))
+    return min(max(1, hours), cutout.data.sizes["time"])
+
+
+# state of a process converting time chunks of the cutout, see _init_pv_worker()
+_pv_worker = {}
+
+
+def _init_pv_worker(cutout, params, gridded=True, selection=None, in_pool=True):
+    if in_pool:
+        # the cutout is opened again in each worker, HDF5 file handles must not be shared with
+        # the parent process
+        cutout = atlite.Cutout(cutout)
+        # workers run in parallel anyway, dask threads in each worker would compete for the cores
+        dask.config.set(scheduler="synchronous")
+    if selection:
+        cutout = cutout.sel(**selection)
+    _pv_worker["cutout"] = cutout
+    _pv_worker["params"] = params
+    _pv_worker["gridded"] = gridded
+
+
+def _convert_pv_chunk(time_idx_start, time_idx_end):
+    """Convert a time chunk of the cutout in a worker, see _init_pv_worker()."""
+    cutout = _pv_worker["cutout"]
+    cutout_chunk = cutout.sel(time=cutout.data.time.isel(time=slice(time_idx_start, time_idx_end)))
+    logging.info(f"Converting chunk {cutout_chunk.data.time[0].values}...")
+
+    with dask.config.set(**{"array.slicing.split_large_chunks": False}):
+        pv_timeseries = convert(
+            cutout_chunk, "pv", _pv_worker["params"], gridded=_pv_worker["gridded"]
+        )
+    return pv_timeseries.transpose("time", "y", "x").load()
+
+
+def pv(
+    cutout,
+    params,
+    out_fname,
+    max_memory_gb=16.0,
+    num_workers=1,
+    gridded=True,
+    selection=None,
+    encoding=None,
+):
+    """Convert the cutout to PV capacity factors and write them to ``out_fname``.
+
+    The cutout is converted in time chunks (see hours_per_chunk()) by ``num_workers`` processes in
+    parallel. Converted chunks are not collected in a list and concatenated at the end, the main
+    process writes each chunk to its slice of the output file as soon as it is available. Only the
+    chunks of the next ``num_workers`` conversions are kept in memory.
+
+    Only a part of the cutout is converted if a selection is given (e.g. a tile, see
+    tile_selection()). The selection is passed separately, because workers open the cutout file
+    again. The values are written with ``encoding``, see encode_values().
+
+    """
+    cutout_selected = cutout.sel(**selection) if selection else cutout
+    num_time_steps = cutout_selected.data.sizes["time"]
+    hours = hours_per_chunk(cutout_selected, max_memory_gb, num_workers)
+    time_chunks = [
+        (start, min(start + hours, num_time_steps)) for start in range(0, num_time_steps, hours)
+    ]
+    logging.info(f"Converting {len(time_chunks)} chunks of {hours} hours...")
+
+    # with encoding, i.e. the same time units in the output file as in the cutout
+    time = cutout_selected.data.time.load()
+
+    executor = None
+    if num_workers == 1:
+        _init_pv_worker(cutout_selected, params, gridded=gridded, in_pool=False)
+    else:
+        cutout_path = str(cutout.path)
+        cutout.data.close()
+        executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            initializer=_init_pv_worker,
+            initargs=(cutout_path, params, gridded, selection),
+        )
 
-        pv_timeseries_chunk = cutout_chunk.pv(**params, matrix=sparse_identity)
-        pv_timeseries_chunk = unstack_to_xy(pv_timeseries_chunk, cutout_chunk)
+    futures = {}
 
-        pv_timeseries.append(pv_timeseries_chunk)
+    def converted_chunk(chunk_idx):
+        if executor is None:
+            return _convert_pv_chunk(*time_chunks[chunk_idx])
+        # keep all workers busy, but convert only a few chunks ahead of the chunk to be written
+        for idx in range(chunk_idx, min(chunk_idx + num_workers, len(time_chunks))):
+            if idx not in futures:
+                futures[idx] = executor.submit(_convert_pv_chunk, *time_chunks[idx])
+        return futures[chunk_idx].result()
 
-        # runtime = time.time() - t0
-        # print("runtime", runtime, "total runtime", 744//CHUNKSIZE * runtime)
+    def converted_values(chunk_idx):
+        chunk = first_chunk if chunk_idx == 0 else converted_chunk(chunk_idx)
+        # release the result of the future, the chunk is written right after this task
+        futures[chunk_idx] = None
+        return chunk.values
 
-    logging.info(f"Merging...")
-    return xr.concat(pv_timeseries, dim="time")
+    with executor or contextlib.nullcontext():
+        # coordinates and attributes of the output are taken from the first chunk
+        first_chunk = converted_chunk(0)
+
+        blocks = [
+            dask.array.from_delayed(
+                dask.delayed(converted_values)(chunk_idx),
+                shape=(end - start,) + first_chunk.shape[1:],
+                dtype=first_chunk.dtype,
+            )
+            for chunk_idx, (start, end) in enumerate(time_chunks)
+        ]
+        pv_timeseries = xr.DataArray(
+            dask.array.concatenate(blocks, axis=0),
+            dims=first_chunk.dims,
+            coords=first_chunk.drop_vars("time").coords,
+            name=first_chunk.name,
+            attrs=first_chunk.attrs,
+        ).assign_coords(time=time)
+
+        pv_timeseries, value_encoding = encode_values(pv_timeseries, **(encoding or {}))
+        delayed = pv_timeseries.to_netcdf(
+            out_fname, encoding={pv_timeseries.name: value_encoding}, compute=False
+        )
+        # one chunk after another, in order of time - the conversion is done by the workers
+        delayed.compute(scheduler="synchronous")
 
 
 @task
-def generate_renewable_timeseries(inputs, outputs, technology, year, month, renewable_params):
+def generate_renewable_timeseries(
+    inputs,
+    outputs,
+    technology,
+    year,
+    month,
+    renewable_params,
+    max_memory_gb=16.0,
+    num_workers=1,
+    gridded=True,
+    tile=(0, 0),
+    num_tiles=(1, 1),
+    encoding=None,
+):
     cutout = create_era5_cutout(inputs, outputs, year, month)
 
-    if technology == "wind":
-        generate = wind
-    elif technology == "pv":
-        generate = pv
+    # the whole grid for num_tiles=(1, 1)
+    selection = tile_selection(cutout, tile, num_tiles)
 
-    logging.info(f"Generate {technology} time series...")
+    logging.info(f"Generate {technology} time series for tile {tile} ({selection})...")
+
+    if technology == "pv":
+        pv(
+            cutout,
+            renewable_params[technology],
+            outputs.renewable_timeseries,
+            max_memory_gb=max_memory_gb,
+            num_workers=num_workers,
+            gridded=gridded,
+            selection=selection,
+            encoding=encoding,
+        )
+    elif technology == "wind":
+        # TODO let's silence the large chunk warning for now, not sure if relevant...
+        with dask.config.set(**{"array.slicing.split_large_chunks": False}):
+            wind_timeseries = wind(
+                cutout.sel(**selection), renewable_params[technology], gridded=gridded
+            )
+        wind_timeseries, value_encoding = encode_values(wind_timeseries, **(encoding or {}))
+        wind_timeseries.to_netcdf(
+            outputs.renewable_timeseries, encoding={wind_timeseries.name: value_encoding}
+        )
+
+
+def _tile_shape(chunk_size):
+    # compact time series (see to_compact()) have at most chunk_size[0] * chunk_size[1] land
+    # pixels per chunk
+    return {"x": chunk_size[0], "y": chunk_size[1], "pixel": chunk_size[0] * chunk_size[1]}
+
+
+def tiled_encoding(timeseries, chunk_size):
+    """NetCDF4 encoding which stores the time series in tiles of ``chunk_size`` pixels in x/y
+    with the full time axis per tile, i.e. one chunk of the optimization reads one tile (or up to
+    four if the chunk is not aligned to the tiles) instead of parts of every time step. Compact
+    time series are stored in tiles of as many pixels as a chunk has."""
+    tile_shape = _tile_shape(chunk_size)
+    chunksizes = tuple(
+        min(tile_shape.get(dim, size), size) for dim, size in timeseries.sizes.items()
+    )
+    return {timeseries.name: {"chunksizes": chunksizes, "contiguous": False}}
+
+
+def _block_dim(timeseries):
+    """Files are read in blocks of rows (y) or in blocks of pixels for compact time series."""
+    return "pixel" if "pixel" in timeseries.dims else "y"
+
+
+def _rows_per_block(timeseries, chunk_size, max_memory_gb):
+    """Number of rows (pixels in y, or pixels for compact time series) of one block read at once,
+    such that a block with the full time axis fits into max_memory_gb. Blocks contain only
+    complete rows of tiles (see tiled_encoding()), so each tile is written only once - writing a
+    compressed tile in parts means to decompress and compress it again for each part."""
+    dim = _block_dim(timeseries)
+    values_per_row = np.prod(
+        [size for other_dim, size in timeseries.sizes.items() if other_dim != dim]
+    )
+    rows = int(max_memory_gb * 1e9 // (values_per_row * timeseries.dtype.itemsize))
+    tile_rows = _tile_shape(chunk_size)[dim]
+    rows = max(tile_rows, rows - rows % tile_rows)
+    return min(rows, timeseries.sizes[dim])
+
+
+def to_compact(timeseries, x_idcs, y_idcs, rows):
+    """Select the given pixels (e.g. land pixels, see land_pixel_indices()) of a time series with
+    dimensions x and y and return a compact time series with dimensions pixel and time. The
+    coordinates x_idx and y_idx map the pixels to the grid, see expand_to_grid() in
+    src/load_data.py for the way back.
+
+    The time series is selected lazily block by block, each dask chunk of the result is one block
+    of ``rows`` rows. Pixels must be sorted by blocks of rows.
+
+    """
+    if (np.diff(y_idcs // rows) < 0).any():
+        raise ValueError(f"pixels need to be sorted by blocks of {rows} rows")
+
+    blocks = []
+    for y_start_idx in range(0, timeseries.sizes["y"], rows):
+        in_block = (y_idcs >= y_start_idx) & (y_idcs < y_start_idx + rows)
+        block = timeseries.isel(y=slice(y_start_idx, y_start_idx + rows))
+        blocks.append(
+            block.isel(
+                x=xr.DataArray(x_idcs[in_block], dims="pixel"),
+                y=xr.DataArray(y_idcs[in_block] - y_start_idx, dims="pixel"),
+            )
+        )
+
+    compact = xr.concat(blocks, dim="pixel").drop_vars(["lon", "lat"], errors="ignore")
+    # the time series of a pixel is contiguous in the file
+    compact = compact.transpose("pixel", ...)
+    return compact.assign_coords(x_idx=("pixel", x_idcs), y_idx=("pixel", y_idcs))
 
-    # TODO let's silence the large chunk warning for now, not sure if relevant...
-    with dask.config.set(**{"array.slicing.split_large_chunks": False}):
-        wind_timeseries = generate(cutout, renewable_params[technology])
-    wind_timeseries.to_netcdf(outputs.renewable_timeseries)
+
+def concat_timeseries(
+    fnames, out_fname, chunk_size, max_memory_gb=4.0, land_pixels=None, encoding=None
+):
+    """Concatenate time series files (e.g. monthly) along the time axis to one file without
+    loading all files into memory.
+
+    The output file is created with the full size first, then blocks of rows with the full time
+    axis (read from all input files) are written to their region of the output file one after
+    another. Peak memory is roughly twice max_memory_gb (a block and the parts read from the input
+    files) plus some overhead, the block size is not reduced below a single row of tiles.
+
+    Parameters
+    ----------
+    fnames : list of str
+        NetCDF files with the variable "specific generation" and dimensions time, x and y, e.g.
+        one file per month or one file per month and tile in x/y, files are combined by their
+        coordinates
+    out_fname : str
+    chunk_size : list of int
+        tile shape in the output file, see tiled_encoding()
+    max_memory_gb : float
+        memory used for a block
+    land_pixels : tuple of np.ndarray
+        if not None, only these pixels are stored in a compact time series with dimensions pixel
+        and time, indices x_idx and y_idx as returned by land_pixel_indices()
+    encoding : dict
+        encoding of the values in the output file, parameters of encode_values()
+
+    """
+    with xr.open_mfdataset(fnames) as timeseries:
+        rows = _rows_per_block(timeseries["specific generation"], chunk_size, max_memory_gb)
+
+    if land_pixels is not None:
+        # blocks of complete bands of chunks, see land_pixel_indices()
+        rows = max(rows, chunk_size[1])
+
+    logging.info(f"Reading blocks of {rows} rows per input file...")
+
+    # dask chunks are `rows` in y with the full time axis, i.e. complete rows of tiles, so each
+    # chunk is written to its own tiles of the output file
+    with xr.open_mfdataset(fnames, chunks={"y": rows}) as timeseries:
+        timeseries = timeseries["specific generation"].chunk({"time": -1})
+        if land_pixels is not None:
+            timeseries = to_compact(timeseries, *land_pixels, rows)
+        _write_blocks(timeseries, out_fname, chunk_size, encoding=encoding)
+
+
+def _write_blocks(timeseries, out_fname, chunk_size, encoding=None):
+    """Write a dask backed time series to a tiled NetCDF file one dask chunk at a time, values
+    are written with ``encoding`` (see encode_values())."""
+    timeseries, value_encoding = encode_values(timeseries, **(encoding or {}))
+    file_encoding = tiled_encoding(timeseries, chunk_size)
+    file_encoding[timeseries.name].update(value_encoding)
+
+    delayed = timeseries.to_netcdf(
+        out_fname,
+        format="NETCDF4",
+        engine="netcdf4",
+        encoding=file_encoding,
+        compute=False,
+    )
+
+    # one block at a time, the default threaded scheduler would read many blocks in parallel
+    with dask.config.set(scheduler="synchronous"):
+        delayed.compute()
+
+
+def resample_timeseries(
+    fname, out_fname, time_period_h, chunk_size, max_memory_gb=4.0, encoding=None
+):
+    """Resample a (yearly) time series file to the time resolution used for the optimization by
+    taking the mean over each time period, the same way as load_chunk_input_profiles() would do
+    it for each chunk. The file is processed in blocks of rows (or pixels for compact time series)
+    with the full time axis, see concat_timeseries() for the parameters."""
+    with xr.open_dataarray(fname) as timeseries:
+        dim = _block_dim(timeseries)
+        rows = _rows_per_block(timeseries.chunk(), chunk_size, max_memory_gb)
+        chunks = {**{other_dim: -1 for other_dim in timeseries.dims}, dim: rows}
+
+    logging.info(f"Resampling blocks of {rows} {dim} to {time_period_h}...")
+
+    with xr.open_dataarray(fname, chunks=chunks) as timeseries:
+        resampled = resample_mean(timeseries, time_period_h)
+        _write_blocks(resampled, out_fname, chunk_size, encoding=encoding)
 
 
 @task
-def concat_renewable_timeseries(inputs, outputs, technology):
-    logging.info(f"Loading {technology} time series...")
+def concat_renewable_timeseries(
+    inputs,
+    outputs,
+    technology,
+    chunk_size,
+    max_memory_gb=4.0,
+    compact=False,
+    encoding=None,
+    min_land_fraction=0.0,
+):
+    land_pixels = None
+    if compact:
+        land_pixels = land_pixel_indices(load_land_mask(min_land_fraction), chunk_size)
+        logging.info(f"Storing {len(land_pixels[0])} land pixels only...")
 
-    renewable_timeseries = xr.open_mfdataset(inputs)["specific generation"]
+    logging.info(f"Concatenating {technology} time series...")
+    concat_timeseries(
+        inputs,
+        outputs[0],
+        chunk_size,
+        max_memory_gb=max_memory_gb,
+        land_pixels=land_pixels,
+        encoding=encoding,
+    )
 
-    logging.info(f"Writing {technology} time series...")
-    renewable_timeseries.to_netcdf(outputs[0])
+
+@task
+def resample_renewable_timeseries(
+    inputs, outputs, technology, time_period_h, chunk_size, max_memory_gb=4.0, encoding=None
+):
+    logging.info(f"Resampling {technology} time series...")
+    resample_timeseries(
+        inputs[0],
+        outputs[0],
+        time_period_h,
+        chunk_size,
+        max_memory_gb=max_memory_gb,
+        encoding=encoding,
+    )
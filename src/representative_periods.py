@@ -0,0 +1,157 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from scipy.cluster.vq import kmeans2
+
+from src.network_template import set_constraint_terms
+
+
+def select_representative_periods(
+    input_profiles,
+    num_periods,
+    period_length_h=24,
+    pixels=None,
+    seed=0,
+):
+    """Reduce the time series of a chunk to a few representative periods (e.g. typical days).
+
+    The time series are split into periods of ``period_length_h`` hours, the periods are clustered
+    by k-means (using PV and wind of all given pixels at once, i.e. all pixels of a chunk share the
+    same periods) and for each cluster the period closest to the cluster center is selected. Real
+    periods instead of cluster centers are used to keep the variability within a period.
+
+    The selected periods are kept in chronological order, so storage is linked from one period to
+    the next one. Each time step gets a weight: the number of time steps of the original time
+    series it represents. See create_methanol_network() for how the weights are used.
+
+    Parameters
+    ----------
+    input_profiles : xr.Dataset
+        with data variables pv_input_profile and wind_input_profile with dimensions x, y and time,
+        time stamps need to be equidistant
+    num_periods : int
+        number of representative periods
+    period_length_h : int
+        length of a period in hours, must be a multiple of the time step
+    pixels : list of tuple
+        pixel indices (x_idx, y_idx) used to select the periods (e.g. land pixels only), if None all
+        pixels are used
+    seed : int
+        seed of the k-means initialization, the selection is reproducible
+
+    Returns
+    -------
+    xr.Dataset
+        input profiles of the representative periods with new equidistant time stamps (syfop
+        requires equidistant time stamps) and the data variable time_weight with dimension time
+
+    """
+    time = input_profiles.time.to_index()
+    time_step = time[1] - time[0]
+    period_steps = pd.Timedelta(f"{period_length_h}h") // time_step
+    num_full_periods = len(time) // period_steps
+
+    if num_periods >= num_full_periods:
+        raise ValueError(
+            f"number of representative periods ({num_periods}) must be smaller than the number of "
+            f"periods of the time series ({num_full_periods})"
+        )
+
+    if pixels is None:
+        pixels = [
+            (x_idx, y_idx)
+            for x_idx in range(input_profiles.sizes["x"])
+            for y_idx in range(input_profiles.sizes["y"])
+        ]
+    x_idcs, y_idcs = (list(idcs) for idcs in zip(*pixels))
+
+    # one row per period with the time series of all pixels, incomplete periods at the end are
+    # not used for clustering
+    features = []
+    for name in ("pv_input_profile", "wind_input_profile"):
+        values = input_profiles[name].transpose("x", "y", "time").values[x_idcs, y_idcs]
+        values = values[:, : num_full_periods * period_steps]
+        values = values.reshape(len(pixels), num_full_periods, period_steps)
+        features.append(values.transpose(1, 0, 2).reshape(num_full_periods, -1))
+    features = np.concatenate(features, axis=1)
+
+    centroids, labels = kmeans2(features, num_periods, minit="++", seed=seed)
+
+    periods = []
+    counts = []
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        distances = np.linalg.norm(features[members] - centroids[cluster], axis=1)
+        periods.append(members[np.argmin(distances)])
+        counts.append(len(members))
+
+    order = np.argsort(periods)
+    periods = np.array(periods)[order]
+    counts = np.array(counts)[order]
+
+    # the time steps of incomplete periods at the end are distributed to all periods
+    counts = counts * len(time) / (num_full_periods * period_steps)
+
+    logging.info(
+        f"Selected {len(periods)} representative periods (start, weight): "
+        + ", ".join(
+            f"{time[period * period_steps]} {count:.2f}" for period, count in zip(periods, counts)
+        )
+    )
+
+    time_idcs = (periods[:, np.newaxis] * period_steps + np.arange(period_steps)).ravel()
+    reduced = input_profiles.isel(time=time_idcs)
+    reduced = reduced.assign_coords(
+        time=pd.date_range(time[0], periods=len(time_idcs), freq=time_step)
+    )
+    reduced["time_weight"] = xr.DataArray(
+        np.repeat(counts, period_steps), coords={"time": reduced.time}
+    )
+
+    return reduced
+
+
+def weight_methanol_production(model, time_weights):
+    """Multiply the methanol charged into the storage of methanol_synthesis at each time step by
+    the weight of the time step in the storage balance. The storage level at the end, which has to
+    cover the methanol demand, is then the weighted sum of the production, i.e. the production of
+    the whole year if the time steps are representative periods.
+
+    Only the methanol production is weighted. All other storages (and the methanol storage level)
+    are still linked between consecutive time steps, i.e. the last time step of a representative
+    period is followed by the first time step of the next selected period, although the periods
+    are not consecutive in the original time series and each period stands for several periods.
+    Storage across periods is therefore only an approximation, e.g. seasonal storage is not
+    modelled correctly.
+
+    Parameters
+    ----------
+    model : linopy.Model
+        model of the methanol network (see create_methanol_network()), modified in place
+    time_weights : xr.DataArray
+        weight of each time step, see select_representative_periods()
+
+    """
+    charge_labels = np.ravel(model.variables["storage_charge_methanol_synthesis"].labels)
+    level_labels = np.ravel(model.variables["storage_level_methanol_synthesis"].labels)
+    time_weights = time_weights.reset_coords(drop=True)
+
+    weighted = []
+    for name in model.constraints:
+        constraint = model.constraints[name]
+        if "time" not in constraint.coord_dims:
+            continue
+        is_charge = constraint.vars.isin(charge_labels)
+        if is_charge.any() and constraint.vars.isin(level_labels).any():
+            set_constraint_terms(
+                constraint,
+                constraint.vars,
+                constraint.coeffs.where(~is_charge, constraint.coeffs * time_weights),
+            )
+            weighted.append(name)
+
+    if not weighted:
+        raise ValueError("storage balance of methanol_synthesis not found")
@@ -0,0 +1,147 @@
+import os
+import time
+import hashlib
+import logging
+import importlib.metadata
+
+import numpy as np
+
+from src.paths import REPO_ROOT_DIR
+
+# source files which define the network and the model, the code version in the cache key (changes
+# in other files, e.g. plotting or logging, do not affect the results of a pixel)
+MODEL_SOURCE_FILES = [
+    "src/methanol_network.py",
+    "src/network_template.py",
+    "src/model_parameters.py",
+    "src/wind_costs.py",
+    "src/solver.py",
+]
+
+# packages which build and solve the model, their versions are part of the cache key
+MODEL_PACKAGES = ["syfop", "linopy"]
+
+
+def _remove(fname):
+    # other jobs using the same cache might have removed the file already
+    try:
+        os.remove(fname)
+    except FileNotFoundError:
+        pass
+
+
+def code_version():
+    """Return a hash of MODEL_SOURCE_FILES and the versions of MODEL_PACKAGES."""
+    code_hash = hashlib.sha256()
+    for fname in MODEL_SOURCE_FILES:
+        with open(REPO_ROOT_DIR / fname, "rb") as f:
+            code_hash.update(f.read())
+    for package in MODEL_PACKAGES:
+        code_hash.update(f"{package}=={importlib.metadata.version(package)}".encode())
+    return code_hash.hexdigest()
+
+
+class ResultCache:
+    """Cache of the results of single pixels, shared by all chunks, runs and scenarios.
+
+    The key of a pixel is a hash of its input profiles and of everything else which affects the
+    result: ``context`` (model parameters, solver and its parameters, names of the variables) and
+    the code version (see code_version()). Pixels with the same input profiles have the same result,
+    no matter which chunk, region or renewable scenario they belong to, e.g. when overlapping
+    regions are optimized or a scenario is added.
+
+    Each entry is a small .npy file in ``cache_dir`` (named after the key, in subfolders by the
+    first two characters of the key) with the values of all variables of a pixel. Files are written
+    to a temporary file first and renamed, so multiple jobs can use the same cache at once. The
+    modification time is updated on each hit, the least recently used entries are removed by
+    evict_result_cache().
+
+    Parameters
+    ----------
+    cache_dir : str or pathlib.Path
+        folder of the cache, created if it does not exist
+    context : str
+        describes all parameters which affect the results except the input profiles
+
+    """
+
+    def __init__(self, cache_dir, context):
+        self.cache_dir = cache_dir
+        self._context = f"{context} code={code_version()}".encode()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *arrays):
+        """Return the key of a pixel given all arrays with its input profiles (and time steps or
+        weights), in the same order for all pixels."""
+        key = hashlib.sha256(self._context)
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            key.update(f"{array.dtype.str}{array.shape}".encode())
+            key.update(array.tobytes())
+        return key.hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npy")
+
+    def get(self, key):
+        """Return the values stored for ``key`` or None if there is no such entry."""
+        fname = self._fname(key)
+        try:
+            values = np.load(fname)
+            os.utime(fname)
+        except (FileNotFoundError, ValueError, OSError):
+            # not cached, removed by another job in between or written only partially
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return values
+
+    def put(self, key, values):
+        """Store the values of a pixel for ``key``."""
+        fname = self._fname(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fname_tmp = f"{fname}.{os.getpid()}.tmp"
+        with open(fname_tmp, "wb") as f:
+            np.save(f, np.asarray(values, dtype=float))
+        os.replace(fname_tmp, fname)
+
+
+def evict_result_cache(cache_dir, max_size_gb):
+    """Remove the least recently used entries of a ResultCache until all entries together need
+    at most max_size_gb on disk (allocated blocks, a small file needs a whole block of the file
+    system). Scans the whole cache folder, i.e. one stat() per entry, so this is done only once
+    per run and scenario (see concat_solution_chunks()) and not for each chunk. Returns the number
+    of entries removed."""
+    entries = []
+    for root, _, fnames in os.walk(cache_dir):
+        for fname in fnames:
+            fname = os.path.join(root, fname)
+            try:
+                stat = os.stat(fname)
+            except FileNotFoundError:
+                continue
+            if fname.endswith(".tmp"):
+                # written by another job right now, or left by a killed job if older
+                if stat.st_mtime < time.time() - 3600:
+                    _remove(fname)
+                continue
+            entries.append((stat.st_mtime, stat.st_blocks * 512, fname))
+
+    total_size = sum(size for _, size, _ in entries)
+    max_size = max_size_gb * 1e9
+    logging.info(f"Result cache {cache_dir}: {len(entries)} entries, {total_size / 1e9:.3f}GB")
+
+    num_removed = 0
+    for _, size, fname in sorted(entries):
+        if total_size <= max_size:
+            break
+        _remove(fname)
+        total_size -= size
+        num_removed += 1
+
+    if num_removed:
+        logging.info(f"Removed {num_removed} entries from result cache {cache_dir}")
+
+    return num_removed
@@ -0,0 +1,194 @@
+import glob
+import heapq
+import logging
+
+import yaml
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from src.task import task
+
+from src.paths import INTERIM_DIR
+
+from src.load_data import load_land_mask
+
+from src.util import land_chunk_indices
+
+
+def load_chunk_runtimes(chunk_size):
+    """Read the run time of chunks optimized in previous runs from the run.yaml files written by
+    optimize_network_chunk(). Returns a dict with the start indices of the chunk as key and the
+    mean run time in seconds as value (the same chunk might have been optimized for multiple
+    renewable scenarios)."""
+    runtimes = {}
+    for fname in glob.glob(str(INTERIM_DIR / "network_solution" / "*.run.yaml")):
+        with open(fname) as f:
+            run_data = yaml.safe_load(f)
+
+        input_params = run_data["input_params"]
+        if run_data["function"] != "optimize_network_chunk" or (
+            list(input_params["chunk_size"]) != list(chunk_size)
+        ):
+            continue
+
+        chunk = input_params["x_start_idx"], input_params["y_start_idx"]
+        runtimes.setdefault(chunk, []).append(run_data["runtime"])
+
+    return {chunk: np.mean(chunk_runtimes) for chunk, chunk_runtimes in runtimes.items()}
+
+
+def estimate_chunk_runtimes(
+    chunk_indices,
+    chunk_size,
+    is_land,
+    pixel_runtimes=None,
+    chunk_runtimes=None,
+):
+    """Estimate the run time of chunks.
+
+    The estimate is the sum of the run times of all land pixels of the chunk from a previous run.
+    If there is no run time for some pixels, the median run time of all known pixels is used for
+    them. If no run time of any pixel of a chunk is known, the run time of the whole chunk from a
+    previous run is used. Without any history, the estimate is simply the number of land pixels.
+
+    Parameters
+    ----------
+    chunk_indices : list of tuple
+        start indices (x_start_idx, y_start_idx) of chunks
+    chunk_size : list of int
+    is_land : np.ndarray
+        boolean array with dimensions x, y of the global grid
+    pixel_runtimes : np.ndarray
+        run time per pixel with the same shape as is_land, NaN if unknown (e.g. for pixels taken
+        from the result cache or deduplicated in the previous run, see MEASURED_VARS in
+        src/optimize.py)
+    chunk_runtimes : dict
+        run time of chunks, see load_chunk_runtimes()
+
+    Returns
+    -------
+    np.ndarray
+        estimated run time for each chunk
+
+    """
+    if pixel_runtimes is None:
+        pixel_runtimes = np.full(is_land.shape, np.nan)
+    if chunk_runtimes is None:
+        chunk_runtimes = {}
+
+    known_runtimes = pixel_runtimes[is_land & ~np.isnan(pixel_runtimes)]
+    if len(known_runtimes):
+        median_runtime = np.median(known_runtimes)
+    elif chunk_runtimes:
+        # run time per land pixel
+        median_runtime = np.median(
+            [
+                runtime / max(is_land[x : x + chunk_size[0], y : y + chunk_size[1]].sum(), 1)
+                for (x, y), runtime in chunk_runtimes.items()
+            ]
+        )
+    else:
+        median_runtime = 1.0
+
+    estimates = np.empty(len(chunk_indices))
+    for i, (x_start_idx, y_start_idx) in enumerate(chunk_indices):
+        chunk = (
+            slice(x_start_idx, x_start_idx + chunk_size[0]),
+            slice(y_start_idx, y_start_idx + chunk_size[1]),
+        )
+        runtimes = pixel_runtimes[chunk][is_land[chunk]]
+
+        if np.isnan(runtimes).all() and (x_start_idx, y_start_idx) in chunk_runtimes:
+            estimates[i] = chunk_runtimes[x_start_idx, y_start_idx]
+        else:
+            estimates[i] = np.where(np.isnan(runtimes), median_runtime, runtimes).sum()
+
+    return estimates
+
+
+def balance_work_units(runtimes, num_work_units):
+    """Distribute items with given run times to a number of work units such that the total run
+    time of the work units is as equal as possible, using the longest processing time first
+    algorithm: items are sorted by run time and each item is assigned to the work unit with the
+    lowest total run time so far.
+
+    Returns a list of lists with the indices of the items of each work unit, empty work units are
+    dropped.
+
+    """
+    heap = [(0.0, work_unit) for work_unit in range(num_work_units)]
+    work_units = [[] for _ in range(num_work_units)]
+
+    # stable sort, so that items with the same run time stay in their original order
+    for idx in np.argsort(-np.asarray(runtimes), kind="stable"):
+        total_runtime, work_unit = heapq.heappop(heap)
+        work_units[work_unit].append(idx)
+        heapq.heappush(heap, (total_runtime + runtimes[idx], work_unit))
+
+    return [sorted(items) for items in work_units if items]
+
+
+@task
+def create_work_units(
+    x_idx_from_to,
+    y_idx_from_to,
+    chunk_size,
+    num_work_units,
+    runtime_history_fname=None,
+    min_land_fraction=0.0,
+    inputs=None,
+    outputs=None,
+):
+    """Distribute all chunks with land pixels to ``num_work_units`` work units with a similar
+    estimated run time and write them to a CSV file with the columns work_unit, x_idx, y_idx and
+    estimated_runtime. See estimate_chunk_runtimes() for the estimate.
+
+    Parameters
+    ----------
+    runtime_history_fname : str
+        a NetCDF file with the variable runtime per pixel from a previous run (e.g. a copy of the
+        concatenated solution), optional
+    min_land_fraction : float
+        see load_land_mask()
+
+    """
+    # the same grid as the renewable time series
+    is_land = load_land_mask(min_land_fraction)
+
+    pixel_runtimes = None
+    if runtime_history_fname is not None:
+        logging.info(f"Using run time per pixel from {runtime_history_fname}...")
+        pixel_runtimes = xr.open_dataset(runtime_history_fname).runtime.reindex(
+            x=is_land.x.values, y=is_land.y.values
+        )
+        pixel_runtimes = pixel_runtimes.transpose("x", "y").values
+
+    chunk_runtimes = load_chunk_runtimes(chunk_size)
+    logging.info(f"Found run time of {len(chunk_runtimes)} chunks from previous runs")
+
+    chunk_indices = land_chunk_indices(is_land, x_idx_from_to, y_idx_from_to, chunk_size)
+    estimates = estimate_chunk_runtimes(
+        chunk_indices,
+        chunk_size,
+        is_land.values,
+        pixel_runtimes=pixel_runtimes,
+        chunk_runtimes=chunk_runtimes,
+    )
+
+    work_units = balance_work_units(estimates, num_work_units)
+
+    rows = [
+        (work_unit, *chunk_indices[idx], estimates[idx])
+        for work_unit, items in enumerate(work_units)
+        for idx in items
+    ]
+    rows = pd.DataFrame(rows, columns=["work_unit", "x_idx", "y_idx", "estimated_runtime"])
+
+    total_runtimes = rows.groupby("work_unit").estimated_runtime.sum()
+    logging.info(
+        f"{len(chunk_indices)} chunks distributed to {len(work_units)} work units, estimated run "
+        f"time per work unit: min {total_runtimes.min()}, max {total_runtimes.max()}"
+    )
+
+    rows.to_csv(outputs[0], index=False)
@@ -8,3 +8,25 @@
 # needs to be set here. Otherwise it will fail.
 #
 # Access e.g. via: snakemake_config.config["testmode"]
+
+import importlib
+
+
+def init_spawned_process(parent_config, log_file, module_name, initializer_name, *initargs):
+    """Initializer of worker processes started with "spawn" instead of "fork", e.g. a
+    ProcessPoolExecutor with mp_context=multiprocessing.get_context("spawn").
+
+    Spawned processes do not inherit the config and the logging setup of the parent process. The
+    config needs to be set before any module using it is imported, therefore the initializer of the
+    worker is given by module and function name and imported afterwards.
+
+    """
+    global config
+    config = parent_config
+
+    from src.logging_config import setup_logging
+
+    setup_logging(fname=log_file, is_script=False)
+
+    initializer = getattr(importlib.import_module(module_name), initializer_name)
+    initializer(*initargs)
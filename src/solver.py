@@ -0,0 +1,389 @@
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+
+class WarmStart:
+    """Keeps the solution and the basis of the last solve in memory to warm start the next solve.
+
+    This makes only sense if the next model has the same structure (same variables and
+    constraints in the same order, only coefficients differ), e.g. the next pixel optimized with a
+    NetworkTemplate. Neighbouring pixels have similar weather, so the optimal basis of one pixel is
+    usually a good start for the next one.
+
+    The solution is passed directly via the Python API of the solver, i.e. no files are written
+    (see comment about basis_fn and warmstart_fn in config/config.yaml).
+
+    """
+
+    def __init__(self):
+        self.solver_name = None
+        self.primal = None
+        self.dual = None
+        self.col_basis = None
+        self.row_basis = None
+
+    def matches(self, solver_name, num_cols, num_rows):
+        """Returns True if there is a previous solution which fits the model to be solved."""
+        return (
+            self.solver_name == solver_name
+            and self.primal is not None
+            and len(self.primal) == num_cols
+            and len(self.dual) == num_rows
+        )
+
+
+def _to_cplex(model):
+    """Pass the linopy model to cplex without writing a LP file. linopy supports only the file
+    API for cplex."""
+    import cplex
+
+    M = model.matrices
+
+    problem = cplex.Cplex()
+
+    if model.objective.sense == "max":
+        problem.objective.set_sense(problem.objective.sense.maximize)
+
+    lower = np.where(np.isinf(M.lb), -cplex.infinity, M.lb)
+    upper = np.where(np.isinf(M.ub), cplex.infinity, M.ub)
+    problem.variables.add(obj=M.c.tolist(), lb=lower.tolist(), ub=upper.tolist())
+
+    senses = pd.Series(M.sense).map({"<": "L", ">": "G", "=": "E"})
+    problem.linear_constraints.add(senses=senses.tolist(), rhs=M.b.tolist())
+
+    # much faster than adding each row as SparsePair
+    A = M.A.tocoo()
+    problem.linear_constraints.set_coefficients(
+        zip(A.row.tolist(), A.col.tolist(), A.data.tolist())
+    )
+
+    return problem
+
+
+def _solve_cplex(model, warmstart, solver_params):
+    import cplex
+
+    problem = _to_cplex(model)
+
+    for key, value in solver_params.items():
+        # nested parameters are separated by dots, same as in linopy
+        param = problem.parameters
+        for key_layer in key.split("."):
+            param = getattr(param, key_layer)
+        param.set(value)
+
+    num_cols = problem.variables.get_num()
+    num_rows = problem.linear_constraints.get_num()
+
+    if warmstart.matches("cplex", num_cols, num_rows):
+        problem.start.set_start(
+            col_status=warmstart.col_basis or [],
+            row_status=warmstart.row_basis or [],
+            col_primal=warmstart.primal.tolist(),
+            row_primal=[],
+            col_dual=[],
+            row_dual=warmstart.dual.tolist(),
+        )
+
+    t0 = time.time()
+    problem.solve()
+    runtime_solver = time.time() - t0
+
+    termination_condition = problem.solution.get_status_string()
+    if problem.solution.get_status() != problem.solution.status.optimal:
+        raise RuntimeError(f"unable to solve optimization: {termination_condition}")
+
+    try:
+        col_basis, row_basis = problem.solution.basis.get_basis()
+    except cplex.exceptions.CplexSolverError:
+        # no basis available, e.g. barrier without crossover
+        col_basis, row_basis = None, None
+
+    return {
+        "problem": problem,
+        "primal": np.array(problem.solution.get_values()),
+        "dual": np.array(problem.solution.get_dual_values()),
+        "col_basis": col_basis,
+        "row_basis": row_basis,
+        "runtime_solver": runtime_solver,
+    }
+
+
+_gurobi_env = None
+
+
+def _solve_gurobi(model, warmstart, solver_params):
+    import gurobipy
+
+    # creating an environment checks the license, so let's do this only once per process
+    global _gurobi_env
+    if _gurobi_env is None:
+        _gurobi_env = gurobipy.Env()
+
+    problem = model.to_gurobipy(env=_gurobi_env)
+
+    for key, value in solver_params.items():
+        problem.setParam(key, value)
+
+    variables = problem.getVars()
+    constraints = problem.getConstrs()
+
+    if warmstart.matches("gurobi", len(variables), len(constraints)):
+        problem.setAttr("PStart", variables, warmstart.primal.tolist())
+        problem.setAttr("DStart", constraints, warmstart.dual.tolist())
+        if warmstart.col_basis is not None:
+            problem.setAttr("VBasis", variables, warmstart.col_basis)
+            problem.setAttr("CBasis", constraints, warmstart.row_basis)
+
+    t0 = time.time()
+    problem.optimize()
+    runtime_solver = time.time() - t0
+
+    if problem.Status != gurobipy.GRB.OPTIMAL:
+        raise RuntimeError(f"unable to solve optimization: status code {problem.Status}")
+
+    try:
+        col_basis = problem.getAttr("VBasis", variables)
+        row_basis = problem.getAttr("CBasis", constraints)
+    except gurobipy.GurobiError:
+        # no basis available, e.g. barrier without crossover
+        col_basis, row_basis = None, None
+
+    return {
+        "problem": problem,
+        "primal": np.array(problem.getAttr("X", variables)),
+        "dual": np.array(problem.getAttr("Pi", constraints)),
+        "col_basis": col_basis,
+        "row_basis": row_basis,
+        "runtime_solver": runtime_solver,
+    }
+
+
+def _solve_highs(model, warmstart, solver_params):
+    problem = model.to_highspy()
+
+    for key, value in solver_params.items():
+        problem.setOptionValue(key, value)
+
+    lp = problem.getLp()
+
+    if warmstart.matches("highs", lp.num_col_, lp.num_row_):
+        if hasattr(problem, "setBasis") and warmstart.col_basis is not None:
+            basis = problem.getBasis()
+            basis.col_status = warmstart.col_basis
+            basis.row_status = warmstart.row_basis
+            problem.setBasis(basis)
+        elif hasattr(problem, "setSolution"):
+            solution = problem.getSolution()
+            solution.col_value = warmstart.primal.tolist()
+            solution.row_dual = warmstart.dual.tolist()
+            problem.setSolution(solution)
+        else:
+            logging.warning("highspy version does not support warm start, upgrade highspy")
+
+    t0 = time.time()
+    problem.run()
+    runtime_solver = time.time() - t0
+
+    model_status = problem.getModelStatus()
+    if problem.modelStatusToString(model_status).lower() != "optimal":
+        raise RuntimeError(
+            f"unable to solve optimization: {problem.modelStatusToString(model_status)}"
+        )
+
+    solution = problem.getSolution()
+    basis = problem.getBasis()
+
+    return {
+        "problem": problem,
+        "primal": np.array(solution.col_value),
+        "dual": np.array(solution.row_dual),
+        "col_basis": basis.col_status if basis.valid else None,
+        "row_basis": basis.row_status if basis.valid else None,
+        "runtime_solver": runtime_solver,
+    }
+
+
+SOLVE_FUNCTIONS = {
+    "cplex": _solve_cplex,
+    "gurobi": _solve_gurobi,
+    "highs": _solve_highs,
+}
+
+
+# values of the statistic "method", the algorithm which found the solution: presolve means that
+# the problem was solved without any simplex or barrier iteration
+METHODS = ("presolve", "simplex", "barrier")
+
+
+def _statistics_cplex(problem):
+    return {
+        # cplex does not provide the run time of the last solve
+        "runtime_solver": np.nan,
+        "simplex_iterations": problem.solution.progress.get_num_iterations(),
+        "barrier_iterations": problem.solution.progress.get_num_barrier_iterations(),
+        "solver_status": problem.solution.get_status(),
+        "objective": problem.solution.get_objective_value(),
+        "num_rows": problem.linear_constraints.get_num(),
+        "num_cols": problem.variables.get_num(),
+        "num_nonzeros": problem.linear_constraints.get_num_nonzeros(),
+    }
+
+
+def _statistics_gurobi(problem):
+    return {
+        "runtime_solver": problem.Runtime,
+        "simplex_iterations": problem.IterCount,
+        "barrier_iterations": problem.BarIterCount,
+        "solver_status": problem.Status,
+        "objective": problem.ObjVal,
+        "num_rows": problem.NumConstrs,
+        "num_cols": problem.NumVars,
+        "num_nonzeros": problem.NumNZs,
+    }
+
+
+def _statistics_highs(problem):
+    info = problem.getInfo()
+    lp = problem.getLp()
+    return {
+        "runtime_solver": problem.getRunTime(),
+        "simplex_iterations": info.simplex_iteration_count,
+        "barrier_iterations": info.ipm_iteration_count,
+        "solver_status": int(problem.getModelStatus()),
+        "objective": problem.getObjectiveValue(),
+        "num_rows": lp.num_row_,
+        "num_cols": lp.num_col_,
+        "num_nonzeros": len(lp.a_matrix_.value_),
+    }
+
+
+# keys of the dict returned by solver_statistics()
+STATISTICS = (
+    "runtime_solver",
+    "simplex_iterations",
+    "barrier_iterations",
+    "method",
+    "solver_status",
+    "objective",
+    "num_rows",
+    "num_cols",
+    "num_nonzeros",
+)
+
+STATISTICS_FUNCTIONS = {
+    "cplex": _statistics_cplex,
+    "gurobi": _statistics_gurobi,
+    "highs": _statistics_highs,
+}
+
+
+def solver_statistics(solver_name, problem):
+    """Read statistics of the last solve from the solver object.
+
+    Parameters
+    ----------
+    solver_name : str
+        name of the solver, statistics are available for cplex, gurobi and highs only
+    problem : cplex.Cplex or gurobipy.Model or highspy.Highs
+        a solved problem, e.g. linopy.Model.solver_model after linopy.Model.solve()
+
+    Returns
+    -------
+    dict
+        runtime_solver (NaN if not provided by the solver), simplex_iterations,
+        barrier_iterations, method (index in METHODS), solver_status (status code of the solver),
+        objective, num_rows, num_cols and num_nonzeros of the constraint matrix; all values are
+        NaN for other solvers supported by linopy (e.g. glpk or cbc)
+
+    """
+    if solver_name not in STATISTICS_FUNCTIONS:
+        return {name: np.nan for name in STATISTICS}
+
+    stats = STATISTICS_FUNCTIONS[solver_name](problem)
+
+    if stats["barrier_iterations"] > 0:
+        method = "barrier"
+    elif stats["simplex_iterations"] > 0:
+        method = "simplex"
+    else:
+        method = "presolve"
+    stats["method"] = METHODS.index(method)
+
+    return stats
+
+
+def _assign_solution(model, primal, dual, objective):
+    """Store the solution in the linopy model the same way as linopy.Model.solve() does."""
+    M = model.matrices
+
+    primal = pd.Series(primal, index=M.vlabels, dtype=float)
+    primal.loc[-1] = np.nan
+    for name, variable in model.variables.items():
+        labels = np.ravel(variable.labels)
+        values = primal.reindex(labels).values.reshape(variable.labels.shape)
+        variable.solution = xr.DataArray(values, variable.coords)
+
+    dual = pd.Series(dual, index=M.clabels, dtype=float)
+    dual.loc[-1] = np.nan
+    for name, constraint in model.constraints.items():
+        labels = np.ravel(constraint.labels)
+        values = dual.reindex(labels).values.reshape(constraint.labels.shape)
+        constraint.dual = xr.DataArray(values, constraint.labels.coords)
+
+    model.objective.set_value(objective)
+    model.status = "ok"
+    model.termination_condition = "optimal"
+
+
+def solve_direct(model, solver_name, warmstart=None, **solver_params):
+    """Solve a linopy model using the Python API of the solver directly, i.e. without writing LP
+    files, and optionally warm start from the previous solution.
+
+    Parameters
+    ----------
+    model : linopy.Model
+        the model to be solved, the solution is stored in the model as in linopy.Model.solve()
+    solver_name : str
+        one of cplex, gurobi or highs
+    warmstart : WarmStart
+        if not None, the previous solution stored in this object is used as starting point if it
+        matches the model and afterwards replaced by the new solution
+    solver_params : kwargs
+        parameters passed to the solver
+
+    Returns
+    -------
+    dict
+        solver statistics, see solver_statistics(), runtime_solver is the wall time of the solve
+        call of the solver
+
+    """
+    if solver_name not in SOLVE_FUNCTIONS:
+        raise ValueError(
+            f"solver '{solver_name}' not supported, must be one of: "
+            f"{', '.join(SOLVE_FUNCTIONS)}"
+        )
+
+    if warmstart is None:
+        # a new object without previous solution means a cold start
+        warmstart = WarmStart()
+
+    result = SOLVE_FUNCTIONS[solver_name](model, warmstart, solver_params)
+
+    stats = solver_statistics(solver_name, result["problem"])
+    stats["runtime_solver"] = result["runtime_solver"]
+
+    # the solver object is not stored in model.solver_model, newer versions of linopy do not allow
+    # to set it
+    _assign_solution(model, result["primal"], result["dual"], stats["objective"])
+
+    warmstart.solver_name = solver_name
+    for attr in ("primal", "dual", "col_basis", "row_basis"):
+        setattr(warmstart, attr, result[attr])
+
+    return stats
@@ -1,4 +1,9 @@
 import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import xarray as xr
 
 from src.paths import INTERIM_DIR
 
@@ -20,3 +25,208 @@ def iter_chunk_indices(
 
     # this could be a generator using yield, but ploomber does not suppot generators
     return [(x_start_idx, y_start_idx) for x_start_idx in x_range for y_start_idx in y_range]
+
+
+def serpentine_order(num_x, num_y):
+    """Return all pixel indices (x_idx, y_idx) of a chunk in serpentine order, i.e. column by
+    column with alternating direction in y, so that consecutive pixels are always neighbours."""
+    order = []
+    for x_idx in range(num_x):
+        y_range = range(num_y) if x_idx % 2 == 0 else reversed(range(num_y))
+        order += [(x_idx, y_idx) for y_idx in y_range]
+    return order
+
+
+def land_mask(land_sea_mask, min_land_fraction=0.0):
+    """Return a boolean mask of the pixels with a land fraction larger than min_land_fraction, with
+    dimensions x and y.
+
+    The land sea mask needs the dimensions longitude and latitude. Sorted in ascending order, the
+    index of a pixel in the land sea mask is the same as the x/y index of the renewable time series
+    (both are global ERA5 grids), so the mask is sorted and renamed to x and y.
+
+    """
+    land_sea_mask = land_sea_mask.squeeze(drop=True).sortby(["longitude", "latitude"])
+    land_sea_mask = land_sea_mask.rename(longitude="x", latitude="y").transpose("x", "y")
+    return (land_sea_mask > min_land_fraction).rename("is_land")
+
+
+def land_chunk_indices(
+    is_land,
+    x_idx_from_to,
+    y_idx_from_to,
+    chunk_size,
+):
+    """Return the start indices of all chunks (see iter_chunk_indices()) which contain at least one
+    pixel with land area. All other chunks do not need to be optimized. ``is_land`` is a boolean
+    array with dimensions x and y of the global grid, see land_mask()."""
+    is_land = np.asarray(is_land)
+    chunk_indices = iter_chunk_indices(x_idx_from_to, y_idx_from_to, chunk_size)
+
+    return [
+        (x_start_idx, y_start_idx)
+        for x_start_idx, y_start_idx in chunk_indices
+        if is_land[
+            x_start_idx : x_start_idx + chunk_size[0],
+            y_start_idx : y_start_idx + chunk_size[1],
+        ].any()
+    ]
+
+
+def land_pixel_indices(is_land, chunk_size):
+    """Return the indices x_idx and y_idx of all pixels with land area of the global grid (see
+    land_mask()) as two arrays in the order of the compact time series files, see to_compact() in
+    src/renewable_timeseries.py.
+
+    Pixels are sorted by bands of chunk_size[1] rows, then by chunks within a band, i.e. the land
+    pixels of a chunk are stored next to each other and a block of complete bands is a contiguous
+    range of pixels.
+
+    """
+    x_idcs, y_idcs = np.nonzero(np.asarray(is_land))
+    order = np.lexsort((y_idcs, x_idcs, x_idcs // chunk_size[0], y_idcs // chunk_size[1]))
+    return x_idcs[order], y_idcs[order]
+
+
+def group_profiles(profiles, tolerance=None):
+    """Group identical rows of a 2D array, e.g. the input profiles of pixels (one row per pixel).
+
+    Parameters
+    ----------
+    profiles : np.ndarray
+        2D array, one row per element to be grouped
+    tolerance : float
+        if None, only bitwise identical rows are grouped. Otherwise rows are grouped if no value
+        differs by more than ``tolerance`` from the representative of the group, the first row of
+        the group. Each row is added to the closest representative. NaN values are equal in both
+        cases.
+
+    Returns
+    -------
+    representatives : np.ndarray
+        index of the representative of each row
+    max_abs_diff : np.ndarray
+        largest absolute difference of each row to its representative
+
+    """
+    profiles = np.ascontiguousarray(profiles)
+
+    if tolerance is None:
+        # one bytes object per row
+        rows = profiles.view(np.dtype((np.void, profiles.dtype.itemsize * profiles.shape[1])))
+        _, first, inverse = np.unique(rows[:, 0], return_index=True, return_inverse=True)
+        return first[inverse.ravel()], np.zeros(len(profiles))
+
+    representatives = np.arange(len(profiles))
+    max_abs_diff = np.zeros(len(profiles))
+    group_idcs = []
+    for idx, profile in enumerate(profiles):
+        if group_idcs:
+            diff = np.abs(profiles[group_idcs] - profile)
+            # NaN values are equal to NaN values only
+            is_nan, profile_is_nan = np.isnan(profiles[group_idcs]), np.isnan(profile)
+            diff[is_nan != profile_is_nan] = np.inf
+            diff[is_nan & profile_is_nan] = 0.0
+            diff = diff.max(axis=1)
+            closest = np.argmin(diff)
+            if diff[closest] <= tolerance:
+                representatives[idx] = group_idcs[closest]
+                max_abs_diff[idx] = diff[closest]
+                continue
+        group_idcs.append(idx)
+
+    return representatives, max_abs_diff
+
+
+def _nanmean(values):
+    """Mean over the last axis ignoring NaN values (NaN if all values are NaN)."""
+    # a NaN value leads to a NaN mean, checking the means is faster than checking all values
+    means = values.mean(axis=-1)
+    if np.isnan(means).any():
+        with warnings.catch_warnings():
+            # all values of a window might be NaN
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            means = np.nanmean(values, axis=-1)
+    return means
+
+
+def _window_mean(values, head, window, tail):
+    """Mean over windows of ``window`` values along the last axis. The first ``head`` and the
+    last ``tail`` values are incomplete windows at the start and the end."""
+    full_windows = values[..., head : values.shape[-1] - tail]
+    full_windows = full_windows.reshape(values.shape[:-1] + (-1, window))
+
+    means = [_nanmean(full_windows)]
+    if head:
+        means.insert(0, _nanmean(values[..., :head])[..., np.newaxis])
+    if tail:
+        means.append(_nanmean(values[..., -tail:])[..., np.newaxis])
+
+    if len(means) == 1:
+        # avoid the copy in concatenate()
+        return means[0]
+    return np.concatenate(means, axis=-1)
+
+
+def resample_mean(timeseries, time_period_h):
+    """Same as ``timeseries.resample(time=time_period_h).mean()`` but much faster for equidistant
+    time series (e.g. hourly) if time_period_h is a multiple of the time step: the mean over all
+    complete windows is computed by reshaping the time axis to (number of windows, window).
+
+    Windows start at midnight of the first day and are labelled with their start, as in
+    resample(). The first and the last window might be incomplete (e.g. at the end of the year),
+    their mean is taken over the available time steps. NaN values are skipped.
+
+    Other time series (e.g. in test mode only a few hours per month are downloaded) are resampled
+    using resample().
+
+    Parameters
+    ----------
+    timeseries : xr.DataArray
+        with dimension time, other dimensions are kept as they are, might be backed by dask if
+        the time axis is a single chunk
+    time_period_h : str
+        length of a window, e.g. "4h"
+
+    Returns
+    -------
+    xr.DataArray
+
+    """
+    time = pd.DatetimeIndex(timeseries.time.values)
+    period = pd.Timedelta(time_period_h)
+
+    time_steps = np.diff(time.values)
+    if (
+        len(time) < 2
+        or (time_steps != time_steps[0]).any()
+        or period % pd.Timedelta(time_steps[0]) != pd.Timedelta(0)
+    ):
+        return timeseries.resample(time=time_period_h).mean()
+
+    time_step = pd.Timedelta(time_steps[0])
+    window = period // time_step
+
+    # start of the first window, same as origin="start_day" in resample()
+    origin = time[0].normalize()
+    start = origin + (time[0] - origin) // period * period
+
+    head = (window - (time[0] - start) // time_step) % window
+    head = min(head, len(time))
+    tail = (len(time) - head) % window
+    num_windows = (head > 0) + (len(time) - head) // window + (tail > 0)
+
+    resampled = xr.apply_ufunc(
+        _window_mean,
+        timeseries,
+        input_core_dims=[["time"]],
+        output_core_dims=[["time"]],
+        exclude_dims={"time"},
+        kwargs={"head": head, "window": window, "tail": tail},
+        dask="parallelized",
+        dask_gufunc_kwargs={"output_sizes": {"time": num_windows}},
+        output_dtypes=[timeseries.dtype],
+    )
+    resampled = resampled.assign_coords(time=pd.date_range(start, periods=num_windows, freq=period))
+
+    return resampled.transpose(*timeseries.dims)
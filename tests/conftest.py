@@ -0,0 +1,4 @@
+from src import snakemake_config
+
+# modules in src need the Snakemake config at import time, see src/snakemake_config.py
+snakemake_config.config = {"testmode": True}
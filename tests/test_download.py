@@ -0,0 +1,92 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.download import download_slot
+from src.download import retrieve_in_parts
+
+
+class FakeCDS:
+    """Local stand-in for the Climate Data Store: writes synthetic data for each request, the
+    first ``failures`` requests of each part fail."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, product, request, target):
+        key = (request["variable"][0], request["day"][0])
+        with self._lock:
+            self.requests.append(key)
+            if self.requests.count(key) <= self.failures:
+                raise ConnectionError("request failed")
+
+        time = pd.to_datetime(
+            [
+                f"{request['year']}-{request['month']}-{day} {hour}"
+                for day in request["day"]
+                for hour in request["time"]
+            ]
+        )
+        north, west, south, east = request["area"]
+        dx, dy = request["grid"]
+        latitude = np.arange(north, south - dy / 2, -dy)
+        longitude = np.arange(west, east + dx / 2, dx)
+        values = time.day.values[:, None, None] + np.zeros((len(latitude), len(longitude)))
+        xr.Dataset(
+            {request["variable"][0]: (("time", "latitude", "longitude"), values)},
+            coords={"time": time, "latitude": latitude, "longitude": longitude},
+        ).to_netcdf(target)
+
+
+def retrieve(parts_dir, backend, **kwargs):
+    return retrieve_in_parts(
+        "reanalysis-era5-single-levels",
+        parts_dir=parts_dir,
+        lock_dir=parts_dir,
+        retrieve=backend,
+        backoff_s=0.0,
+        variable=["2m_temperature", "soil_temperature_level_4"],
+        year="2011",
+        month="1",
+        day=[1, 2, 3],
+        time=["12:00", "13:00"],
+        area=[1.0, -1.0, -1.0, 1.0],
+        grid=[0.5, 0.5],
+        **kwargs,
+    )
+
+
+def test_retrieve_in_parts(tmp_path):
+    backend = FakeCDS(failures=1)
+    ds = retrieve(tmp_path, backend, max_parallel=2, max_retries=1).load()
+
+    # each part failed once and was retried
+    assert len(backend.requests) == 2 * 2 * 3
+    assert set(ds.data_vars) == {"2m_temperature", "soil_temperature_level_4"}
+    assert ds.sizes == {"time": 6, "latitude": 5, "longitude": 5}
+    np.testing.assert_array_equal(
+        ds["2m_temperature"].max(["latitude", "longitude"]), [1, 1, 2, 2, 3, 3]
+    )
+    assert not list(tmp_path.glob("*.part"))
+
+    # parts are not downloaded again
+    retrieve(tmp_path, FakeCDS(failures=1000), max_retries=0)
+
+
+def test_retrieve_in_parts_failure(tmp_path):
+    with pytest.raises(ConnectionError):
+        retrieve(tmp_path, FakeCDS(failures=3), max_retries=2)
+    assert not list(tmp_path.glob("*.nc*"))
+
+
+def test_download_slot(tmp_path):
+    with download_slot(tmp_path, 2) as slot:
+        with download_slot(tmp_path, 2) as other_slot:
+            assert {slot, other_slot} == {0, 1}
+        with download_slot(tmp_path, 2) as other_slot:
+            assert other_slot == 1 - slot
@@ -0,0 +1,198 @@
+import linopy
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src import network_template
+from src.network_template import NetworkTemplate
+from src.solver import solve_direct
+
+
+def create_input_profiles(seed, num_days=2):
+    rng = np.random.default_rng(seed)
+    time = pd.date_range("2011-01-01", periods=num_days * 24, freq="h", name="time")
+    hour = time.hour.values
+    pv = np.clip(np.sin((hour - 6) / 12 * np.pi), 0, None) * rng.uniform(0.5, 1, len(time))
+    wind = rng.uniform(0, 1, len(time))
+
+    def data_array(values):
+        return xr.DataArray(
+            values[np.newaxis, np.newaxis],
+            dims=("x", "y", "time"),
+            coords={"x": [10.0], "y": [45.0], "time": time},
+        )
+
+    return data_array(pv), data_array(wind)
+
+
+class ToyNetwork:
+    """A small linopy model with the structure used by NetworkTemplate, but without syfop: PV and
+    wind with a size multiplied by the input profile, an electricity storage and a constant
+    demand. Can be used as ``create_network`` of the template."""
+
+    def __init__(self, pv_input_profile, wind_input_profile, demand=1.0, time_weights=None):
+        model = linopy.Model()
+        time = pv_input_profile.time.to_index()
+
+        sizes = {
+            name: model.add_variables(lower=0, name=f"size_{name}")
+            for name in ("solar_pv", "wind", "storage_electricity")
+        }
+        flow_pv = model.add_variables(lower=0, coords=[time], name="flow_solar_pv")
+        flow_wind = model.add_variables(lower=0, coords=[time], name="flow_wind")
+        level = model.add_variables(lower=0, coords=[time], name="storage_level_electricity")
+
+        for flow, input_profile, name in (
+            (flow_pv, pv_input_profile, "solar_pv"),
+            (flow_wind, wind_input_profile, "wind"),
+        ):
+            input_profile = input_profile.squeeze(drop=True).reset_coords(drop=True)
+            model.add_constraints(
+                flow - input_profile * sizes[name] <= 0, name=f"input_profile_{name}"
+            )
+        model.add_constraints(
+            level - level.roll(time=1) - flow_pv - flow_wind == -demand, name="storage_balance"
+        )
+        model.add_constraints(level <= sizes["storage_electricity"], name="storage_size")
+        model.add_objective(
+            50 * sizes["solar_pv"] + 100 * sizes["wind"] + 10 * sizes["storage_electricity"]
+        )
+
+        self.model = model
+
+    def optimize(self, solver_name, **solver_params):
+        self.model.solve(solver_name=solver_name, **solver_params)
+        assert self.model.termination_condition == "optimal"
+
+
+@pytest.mark.parametrize("terms_api", [network_template.CONSTRAINT_TERMS_API, None])
+def test_update_input_profiles(monkeypatch, terms_api):
+    pytest.importorskip("highspy")
+
+    # None: linopy does not allow to set the terms of a constraint, the network is created for
+    # each pixel instead
+    monkeypatch.setattr(network_template, "CONSTRAINT_TERMS_API", terms_api)
+
+    pv_input_profile, _ = create_input_profiles(0)
+    template = NetworkTemplate(
+        time_coords=pv_input_profile.time, create_network=ToyNetwork, demand=2.0
+    )
+    assert template.replace_terms == (terms_api is not None)
+
+    # the same template is used for several pixels with different input profiles, the model is
+    # passed to the solver in memory too, i.e. the matrices of the model must not be outdated
+    for seed in (1, 2, 3):
+        pv_input_profile, wind_input_profile = create_input_profiles(seed)
+
+        expected = ToyNetwork(pv_input_profile, wind_input_profile, demand=2.0)
+        expected.optimize("highs", output_flag=False)
+
+        network = template.update_input_profiles(
+            pv_input_profile=pv_input_profile,
+            wind_input_profile=wind_input_profile,
+        )
+        assert (network is template.network) == (terms_api is not None)
+        for optimize in (
+            lambda: network.optimize("highs", output_flag=False),
+            lambda: solve_direct(network.model, "highs", output_flag=False),
+        ):
+            optimize()
+            assert network.model.objective.value == pytest.approx(expected.model.objective.value)
+            for name in ("size_solar_pv", "size_wind", "size_storage_electricity"):
+                assert network.model.solution[name].item() == pytest.approx(
+                    expected.model.solution[name].item(), rel=1e-6, abs=1e-6
+                )
+
+    # input profiles of several pixels or with other time stamps
+    pv_input_profiles = xr.concat([pv_input_profile, pv_input_profile], dim="x")
+    with pytest.raises(ValueError, match="not a single pixel"):
+        template.update_input_profiles(pv_input_profiles, wind_input_profile)
+    with pytest.raises(ValueError, match="time stamps"):
+        template.update_input_profiles(
+            pv_input_profile.isel(time=slice(1, None)), wind_input_profile
+        )
+
+
+def test_create_batch_model():
+    pytest.importorskip("highspy")
+
+    pv_input_profiles, wind_input_profiles = (
+        xr.concat(profiles, dim="pixel").squeeze(["x", "y"], drop=True)
+        for profiles in zip(*(create_input_profiles(seed) for seed in (1, 2, 3)))
+    )
+    template = NetworkTemplate(
+        time_coords=pv_input_profiles.time, create_network=ToyNetwork, demand=2.0
+    )
+
+    model, pixel_objective = template.create_batch_model(
+        pv_input_profiles=pv_input_profiles, wind_input_profiles=wind_input_profiles
+    )
+    assert set(model.variables) == set(template.network.model.variables)
+    model.solve(solver_name="highs", output_flag=False)
+    assert model.termination_condition == "optimal"
+
+    # the blocks of the pixels are independent, i.e. the same as optimizing each pixel alone
+    for pixel in range(3):
+        expected = ToyNetwork(
+            pv_input_profiles.isel(pixel=pixel), wind_input_profiles.isel(pixel=pixel), demand=2.0
+        )
+        expected.optimize("highs", output_flag=False)
+
+        assert pixel_objective.solution[pixel].item() == pytest.approx(
+            expected.model.objective.value
+        )
+        for name in ("size_solar_pv", "size_wind", "size_storage_electricity"):
+            assert model.solution[name][pixel].item() == pytest.approx(
+                expected.model.solution[name].item(), rel=1e-6, abs=1e-6
+            )
+
+    assert model.objective.value == pytest.approx(float(pixel_objective.solution.sum()))
+
+
+@pytest.mark.parametrize("replace_terms", [True, False])
+def test_network_template(monkeypatch, replace_terms):
+    # the network is created with syfop, which needs to be installed from github (see INSTALL.md)
+    pytest.importorskip("syfop")
+
+    from src.methanol_network import create_methanol_network
+    from src.optimize import MODEL_PARAMS
+
+    if not replace_terms:
+        # linopy does not allow to set the terms of a constraint, the network is created for each
+        # pixel instead
+        monkeypatch.setattr(network_template, "CONSTRAINT_TERMS_API", None)
+
+    pv_input_profile, _ = create_input_profiles(0)
+    template = NetworkTemplate(time_coords=pv_input_profile.time, **MODEL_PARAMS)
+    assert template.replace_terms == replace_terms
+
+    # the same template is used for two pixels with different input profiles
+    for seed in (1, 2):
+        pv_input_profile, wind_input_profile = create_input_profiles(seed)
+
+        expected = create_methanol_network(
+            pv_input_profile=pv_input_profile.squeeze(drop=True),
+            wind_input_profile=wind_input_profile.squeeze(drop=True),
+            **MODEL_PARAMS,
+        )
+        expected.optimize(solver_name="highs")
+
+        network = template.update_input_profiles(
+            pv_input_profile=pv_input_profile,
+            wind_input_profile=wind_input_profile,
+        )
+        network.optimize(solver_name="highs")
+
+        assert network.model.objective.value == pytest.approx(expected.model.objective.value)
+
+        # the sizes are unique, flows might not be if there is curtailment
+        size_names = [name for name in expected.model.variables if name.startswith("size_")]
+        assert size_names
+        for name in size_names:
+            np.testing.assert_allclose(
+                network.model.solution[name],
+                expected.model.solution[name],
+                rtol=1e-6,
+                atol=1e-6,
+            )
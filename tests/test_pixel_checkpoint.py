@@ -0,0 +1,68 @@
+import numpy as np
+
+from src.pixel_checkpoint import PixelCheckpoint
+
+VARIABLES = ["objective", "size_wind"]
+
+
+def test_pixel_checkpoint_resume(tmp_path):
+    fname = tmp_path / "chunk.nc.checkpoint"
+
+    checkpoint = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h")
+    assert checkpoint.load() == {}
+    checkpoint.append((0, 1), [1.5, 0.1])
+    checkpoint.append((2, 0), [np.nan, 1 / 3])
+
+    # a killed job does not close the file, lines are written nevertheless
+    results = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h").load()
+    assert list(results) == [(0, 1), (2, 0)]
+    np.testing.assert_array_equal(results[0, 1], [1.5, 0.1])
+    # NaN and all digits of floats survive the round trip
+    np.testing.assert_array_equal(results[2, 0], [np.nan, 1 / 3])
+
+    checkpoint.remove()
+    assert not fname.exists()
+
+
+def test_pixel_checkpoint_truncated_line(tmp_path):
+    fname = tmp_path / "chunk.nc.checkpoint"
+
+    checkpoint = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h")
+    checkpoint.load()
+    checkpoint.append((0, 0), [1.0, 2.0])
+    checkpoint.append((0, 1), [3.0, 4.0])
+
+    # the process was killed while writing the last line
+    with open(fname, "r+") as f:
+        content = f.read()
+        f.seek(0)
+        f.write(content[:-4])
+        f.truncate()
+
+    checkpoint = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h")
+    results = checkpoint.load()
+    assert list(results) == [(0, 0)]
+
+    # the file has been rewritten without the truncated line, new pixels can be appended
+    checkpoint.append((0, 1), [5.0, 6.0])
+    results = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h").load()
+    assert list(results) == [(0, 0), (0, 1)]
+    np.testing.assert_array_equal(results[0, 1], [5.0, 6.0])
+
+
+def test_pixel_checkpoint_mismatch(tmp_path):
+    fname = tmp_path / "chunk.nc.checkpoint"
+
+    checkpoint = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h")
+    checkpoint.load()
+    checkpoint.append((0, 0), [1.0, 2.0])
+
+    # other parameters: the file is not used and the pixels are discarded
+    assert PixelCheckpoint(fname, VARIABLES, "time_period_h=4h").load() == {}
+    assert PixelCheckpoint(fname, VARIABLES, "time_period_h=1h").load() == {}
+
+    # other variables, i.e. a different header
+    checkpoint = PixelCheckpoint(fname, VARIABLES, "time_period_h=1h")
+    checkpoint.load()
+    checkpoint.append((0, 0), [1.0, 2.0])
+    assert PixelCheckpoint(fname, VARIABLES[:1], "time_period_h=1h").load() == {}
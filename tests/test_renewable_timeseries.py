@@ -0,0 +1,220 @@
+import atlite
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from atlite.pv.solar_position import SolarPosition
+
+from src.util import land_mask
+from src.util import land_pixel_indices
+from src.load_data import expand_to_grid
+from src.renewable_timeseries import convert
+from src.renewable_timeseries import concat_timeseries
+from src.renewable_timeseries import hours_per_chunk
+from src.renewable_timeseries import pv
+from src.renewable_timeseries import tile_selection
+
+
+def create_monthly_files(path, num_months=3, num_x=12, num_y=7):
+    rng = np.random.default_rng(42)
+    fnames = []
+    for month in range(1, num_months + 1):
+        time = pd.date_range(f"2011-{month:02d}-01", periods=24 + month, freq="h")
+        timeseries = xr.DataArray(
+            rng.random((len(time), num_y, num_x)),
+            dims=("time", "y", "x"),
+            coords={"time": time, "y": np.linspace(-10, 10, num_y), "x": np.arange(num_x)},
+            name="specific generation",
+        )
+        timeseries[0, 0, 0] = np.nan
+        fname = path / f"month-{month}.nc"
+        timeseries.to_netcdf(fname)
+        fnames.append(fname)
+    return fnames
+
+
+def test_concat_timeseries(tmp_path):
+    fnames = create_monthly_files(tmp_path)
+
+    # the implementation before streaming
+    expected_fname = tmp_path / "expected.nc"
+    xr.open_mfdataset(fnames)["specific generation"].to_netcdf(expected_fname)
+
+    # a tiny memory budget, i.e. a single row of tiles per block
+    out_fname = tmp_path / "out.nc"
+    concat_timeseries(fnames, out_fname, chunk_size=[5, 5], max_memory_gb=1e-9)
+
+    with xr.open_dataarray(expected_fname) as expected, xr.open_dataarray(out_fname) as out:
+        xr.testing.assert_identical(out, expected)
+        assert out.encoding["chunksizes"] == (expected.sizes["time"], 5, 5)
+        assert out.time.encoding["units"] == expected.time.encoding["units"]
+
+
+def test_concat_timeseries_tiles(tmp_path):
+    fnames = create_monthly_files(tmp_path)
+
+    expected_fname = tmp_path / "expected.nc"
+    concat_timeseries(fnames, expected_fname, chunk_size=[5, 5])
+
+    # monthly files split into 3x2 tiles of different size
+    tile_fnames = []
+    for fname in fnames:
+        with xr.open_dataarray(fname) as timeseries:
+            for x_slice in (slice(0, 4), slice(4, 5), slice(5, None)):
+                for y_slice in (slice(0, 3), slice(3, None)):
+                    tile_fname = tmp_path / f"{fname.stem}-{x_slice.start}-{y_slice.start}.nc"
+                    timeseries.isel(x=x_slice, y=y_slice).to_netcdf(tile_fname)
+                    tile_fnames.append(tile_fname)
+
+    out_fname = tmp_path / "out.nc"
+    concat_timeseries(tile_fnames, out_fname, chunk_size=[5, 5], max_memory_gb=1e-9)
+
+    with xr.open_dataarray(expected_fname) as expected, xr.open_dataarray(out_fname) as out:
+        xr.testing.assert_identical(out, expected)
+
+
+@pytest.mark.parametrize(
+    "encoding, max_abs_error",
+    [
+        ({"dtype": "float32"}, 1e-7),
+        ({"dtype": "uint16", "max_value": 1.0, "compression": "zlib"}, 0.5 / 65534 + 1e-7),
+    ],
+)
+def test_concat_timeseries_encoding(tmp_path, encoding, max_abs_error):
+    fnames = create_monthly_files(tmp_path)
+
+    out_fname = tmp_path / "out.nc"
+    concat_timeseries(fnames, out_fname, chunk_size=[5, 5], encoding=encoding)
+
+    # encoding the values again does not change them, e.g. when resampling
+    out_again_fname = tmp_path / "out_again.nc"
+    concat_timeseries([out_fname], out_again_fname, chunk_size=[5, 5], encoding=encoding)
+
+    with xr.open_mfdataset(fnames) as expected, xr.open_dataarray(out_fname) as out:
+        expected = expected["specific generation"].load()
+        assert out.encoding["dtype"] == np.dtype(encoding["dtype"])
+        assert out.dtype == np.float32
+        assert np.isnan(out[0, 0, 0])
+        assert float(abs(out - expected).max()) < max_abs_error
+
+        with xr.open_dataarray(out_again_fname) as out_again:
+            xr.testing.assert_identical(out_again, out)
+
+
+def test_concat_timeseries_compact(tmp_path):
+    fnames = create_monthly_files(tmp_path)
+
+    expected_fname = tmp_path / "expected.nc"
+    concat_timeseries(fnames, expected_fname, chunk_size=[5, 5])
+
+    rng = np.random.default_rng(42)
+    land_sea_mask = xr.DataArray(
+        rng.random((7, 12)) * (rng.random((7, 12)) > 0.6),
+        dims=("latitude", "longitude"),
+        coords={"latitude": np.linspace(-10, 10, 7), "longitude": np.arange(12)},
+    )
+    land_pixels = land_pixel_indices(land_mask(land_sea_mask), chunk_size=[5, 2])
+
+    out_fname = tmp_path / "out.nc"
+    concat_timeseries(
+        fnames, out_fname, chunk_size=[5, 2], max_memory_gb=1e-9, land_pixels=land_pixels
+    )
+
+    with xr.open_dataarray(expected_fname) as expected, xr.open_dataarray(out_fname) as out:
+        assert out.dims == ("pixel", "time")
+        assert out.encoding["chunksizes"] == (10, expected.sizes["time"])
+        np.testing.assert_array_equal(out.x_idx, land_pixels[0])
+        np.testing.assert_array_equal(out.y_idx, land_pixels[1])
+
+        is_land = (land_sea_mask > 0).rename(latitude="y", longitude="x")
+        x, y = expected.x.values, expected.y.values
+        for x_slice, y_slice in ((slice(None), slice(None)), (slice(5, 10), slice(2, 4))):
+            xr.testing.assert_identical(
+                expand_to_grid(out, x, y, x_slice, y_slice).transpose(*expected.dims),
+                expected.where(is_land).isel(x=x_slice, y=y_slice),
+            )
+            xr.testing.assert_identical(
+                expand_to_grid(out.chunk(), x, y, x_slice, y_slice).transpose(*expected.dims),
+                expected.where(is_land).isel(x=x_slice, y=y_slice),
+            )
+
+
+def create_cutout(path, num_x=6, num_y=4, num_time_steps=48):
+    """A cutout with random ERA5 data (only variables needed for PV and wind)."""
+    rng = np.random.default_rng(42)
+    x = 10 + 0.25 * np.arange(num_x)
+    y = 45 + 0.25 * np.arange(num_y)
+    time = pd.date_range("2011-06-01", periods=num_time_steps, freq="h")
+
+    def random(low, high, dims=("time", "y", "x")):
+        sizes = {"time": num_time_steps, "y": num_y, "x": num_x}
+        return dims, rng.uniform(low, high, [sizes[dim] for dim in dims])
+
+    data = xr.Dataset(
+        {
+            "influx_toa": random(0, 1300),
+            "influx_direct": random(0, 800),
+            "influx_diffuse": random(0, 300),
+            "albedo": random(0, 0.5),
+            "temperature": random(260, 310),
+            "wnd100m": random(0, 25),
+            "wnd_shear_exp": random(0.05, 0.3),
+            "wnd_azimuth": random(0, 2 * np.pi),
+            "roughness": random(0.001, 1, dims=("y", "x")),
+        },
+        coords={"time": time, "y": y, "x": x, "lon": ("x", x), "lat": ("y", y)},
+    )
+    solar_position = SolarPosition(data)
+    data["solar_altitude"] = solar_position.altitude
+    data["solar_azimuth"] = solar_position.azimuth
+    data.attrs.update(module="era5", dx=0.25, dy=0.25, dt="h")
+
+    data.to_netcdf(path)
+    return atlite.Cutout(path)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::FutureWarning")
+@pytest.mark.parametrize(
+    "technology, params",
+    [
+        ("pv", {"panel": "CSi", "orientation": {"slope": 30.0, "azimuth": 180.0}}),
+        ("wind", {"turbine": "Vestas_V90_3MW"}),
+    ],
+)
+def test_convert_gridded(tmp_path, technology, params):
+    cutout = create_cutout(tmp_path / "cutout.nc")
+
+    expected = convert(cutout, technology, params, gridded=False).load()
+    timeseries = convert(cutout, technology, params, gridded=True).load()
+
+    assert timeseries.dims == ("time", "y", "x")
+    assert timeseries.name == expected.name
+    assert float(timeseries.max()) > 0.0
+    # identical numbers, lon/lat are 2D coordinates after unstacking
+    xr.testing.assert_equal(
+        timeseries.drop_vars(["lon", "lat"]), expected.drop_vars(["lon", "lat"])
+    )
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::FutureWarning")
+@pytest.mark.parametrize("num_workers", [1, 2])
+@pytest.mark.parametrize("tile", [None, (1, 0)])
+def test_pv(tmp_path, num_workers, tile):
+    cutout = create_cutout(tmp_path / "cutout.nc")
+    params = {"panel": "CSi", "orientation": {"slope": 30.0, "azimuth": 180.0}}
+
+    selection = None if tile is None else tile_selection(cutout, tile, num_tiles=(2, 2))
+    cutout_selected = cutout.sel(**selection) if selection else cutout
+    expected = convert(cutout_selected, "pv", params).transpose("time", "y", "x").load()
+
+    # a tiny memory budget, i.e. many time chunks, not all of the same size
+    max_memory_gb = 1e-4
+    assert cutout.data.sizes["time"] % hours_per_chunk(cutout_selected, max_memory_gb, num_workers) != 0
+
+    out_fname = tmp_path / "pv.nc"
+    pv(cutout, params, out_fname, max_memory_gb, num_workers=num_workers, selection=selection)
+
+    with xr.open_dataarray(out_fname) as out:
+        # identical to the serial conversion of the whole cutout at once
+        xr.testing.assert_identical(out.load(), expected)
@@ -0,0 +1,117 @@
+import linopy
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.representative_periods import select_representative_periods
+from src.representative_periods import weight_methanol_production
+
+
+def create_input_profiles(num_days=10, num_extra_hours=5, num_x=3, num_y=2):
+    """Hourly PV and wind profiles of a few pixels, each day is one of three patterns plus a bit
+    of noise. An incomplete day at the end."""
+    rng = np.random.default_rng(42)
+    patterns = rng.random((3, 2, num_x, num_y, 24))
+    days = [patterns[pattern] for pattern in rng.integers(0, 3, num_days)]
+    values = np.concatenate(days + [patterns[0][..., :num_extra_hours]], axis=-1)
+    values = values + 0.01 * rng.random(values.shape)
+    time = pd.date_range("2011-01-01", periods=values.shape[-1], freq="h")
+
+    def data_array(values):
+        return xr.DataArray(
+            values,
+            dims=("x", "y", "time"),
+            coords={"x": np.arange(num_x) * 0.25, "y": np.arange(num_y) * 0.25, "time": time},
+        )
+
+    return xr.Dataset(
+        {"pv_input_profile": data_array(values[0]), "wind_input_profile": data_array(values[1])}
+    )
+
+
+def test_select_representative_periods():
+    input_profiles = create_input_profiles()
+
+    reduced = select_representative_periods(input_profiles, num_periods=3, period_length_h=24)
+
+    assert reduced.sizes["time"] == 3 * 24
+    # equidistant time stamps starting at the first time stamp
+    np.testing.assert_array_equal(
+        reduced.time, pd.date_range("2011-01-01", periods=3 * 24, freq="h")
+    )
+    # each time step represents a number of time steps, all together the full time series
+    assert float(reduced.time_weight.sum()) == pytest.approx(input_profiles.sizes["time"])
+    assert (reduced.time_weight > 0).all()
+
+    # the selected periods are real days of the input, in chronological order
+    days = input_profiles.pv_input_profile.isel(time=slice(0, 10 * 24)).values
+    days = days.reshape(*days.shape[:2], 10, 24)
+    selected_days = []
+    for period in range(3):
+        period_values = reduced.pv_input_profile.isel(time=slice(period * 24, (period + 1) * 24))
+        matches = [
+            day
+            for day in range(10)
+            if np.array_equal(days[:, :, day], period_values.transpose("x", "y", "time").values)
+        ]
+        assert len(matches) == 1
+        selected_days.append(matches[0])
+    assert selected_days == sorted(selected_days)
+
+    # reproducible with the same seed
+    xr.testing.assert_identical(
+        select_representative_periods(input_profiles, num_periods=3, period_length_h=24),
+        reduced,
+    )
+
+
+def test_select_representative_periods_pixels():
+    input_profiles = create_input_profiles()
+
+    # only the given pixels are used for the selection, the others are kept
+    reduced = select_representative_periods(input_profiles, 4, pixels=[(0, 0), (2, 1)])
+    assert reduced.pv_input_profile.sizes == {"x": 3, "y": 2, "time": 4 * 24}
+
+
+def test_select_representative_periods_too_many():
+    input_profiles = create_input_profiles()
+
+    # 10 complete days, the incomplete day at the end does not count
+    for num_periods in (10, 11):
+        with pytest.raises(ValueError, match="must be smaller"):
+            select_representative_periods(input_profiles, num_periods, period_length_h=24)
+
+
+def test_weight_methanol_production():
+    # the variables and constraints of the methanol storage as in the syfop network
+    time = pd.date_range("2011-01-01", periods=4, freq="h", name="time")
+    model = linopy.Model()
+    charge = model.add_variables(lower=0, coords=[time], name="storage_charge_methanol_synthesis")
+    level = model.add_variables(lower=0, coords=[time], name="storage_level_methanol_synthesis")
+    size = model.add_variables(lower=0, name="size_methanol_synthesis")
+    model.add_constraints(level - level.roll(time=1) - 0.9 * charge == 0, name="storage_balance")
+    model.add_constraints(charge <= size, name="max_charging_speed")
+
+    coeffs = {name: model.constraints[name].coeffs.copy() for name in model.constraints}
+    time_weights = xr.DataArray([1.0, 2.0, 3.0, 4.0], coords={"time": time})
+    weight_methanol_production(model, time_weights)
+
+    # only the charge in the storage balance is weighted, the storage level is not
+    balance = model.constraints["storage_balance"]
+    is_charge = balance.vars.isin(np.ravel(charge.labels))
+    np.testing.assert_allclose(
+        balance.coeffs.where(is_charge).sum(balance.term_dim).transpose("time"),
+        -0.9 * time_weights,
+    )
+    xr.testing.assert_equal(
+        balance.coeffs.where(~is_charge), coeffs["storage_balance"].where(~is_charge)
+    )
+    xr.testing.assert_equal(
+        model.constraints["max_charging_speed"].coeffs, coeffs["max_charging_speed"]
+    )
+
+    # a model without the storage balance
+    model.remove_constraints("storage_balance")
+    with pytest.raises(ValueError, match="storage balance"):
+        weight_methanol_production(model, time_weights)
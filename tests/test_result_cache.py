@@ -0,0 +1,46 @@
+import os
+
+import numpy as np
+
+from src import result_cache
+from src.result_cache import ResultCache
+from src.result_cache import evict_result_cache
+
+
+def test_result_cache(tmp_path, monkeypatch):
+    # package versions are not relevant here
+    monkeypatch.setattr(result_cache, "MODEL_PACKAGES", [])
+
+    cache = ResultCache(tmp_path, "solver=highs")
+    profiles = np.linspace(0, 1, 24)
+    key = cache.key(profiles, 0.5 * profiles)
+
+    assert cache.get(key) is None
+    cache.put(key, [1.0, np.nan, 3.0])
+    np.testing.assert_array_equal(cache.get(key), [1.0, np.nan, 3.0])
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # any change of the inputs or of the context is a different key
+    assert cache.key(profiles, 0.5 * profiles) == key
+    assert cache.key(0.5 * profiles, profiles) != key
+    assert cache.key(profiles.astype(np.float32), 0.5 * profiles) != key
+    assert ResultCache(tmp_path, "solver=cplex").key(profiles, 0.5 * profiles) != key
+
+
+def test_result_cache_evict(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "MODEL_PACKAGES", [])
+
+    cache = ResultCache(tmp_path, "")
+    keys = [cache.key(np.array([i])) for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, [float(i)])
+        os.utime(cache._fname(key), (i, i))
+
+    # the oldest entry is used again, i.e. the second oldest is removed first
+    cache.get(keys[0])
+    # the size on disk, i.e. a whole block of the file system per entry
+    entry_size = os.stat(cache._fname(keys[0])).st_blocks * 512
+    assert entry_size >= os.path.getsize(cache._fname(keys[0]))
+
+    assert evict_result_cache(tmp_path, max_size_gb=3.5 * entry_size / 1e9) == 2
+    assert [cache.get(key) is not None for key in keys] == [True, False, False, True, True]
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+import yaml
+
+from src import scheduler
+from src.scheduler import balance_work_units
+from src.scheduler import create_work_units
+from src.scheduler import estimate_chunk_runtimes
+from src.scheduler import load_chunk_runtimes
+
+
+def test_balance_work_units():
+    # longest processing time first: 5 -> A, 4 -> B, 3 -> B (7), 3 -> A (8), 3 -> B (10)
+    assert balance_work_units([3, 5, 3, 4, 3], 2) == [[1, 2], [0, 3, 4]]
+
+    # more work units than items, empty work units are dropped
+    assert balance_work_units([1.0, 2.0], 5) == [[1], [0]]
+
+
+def test_estimate_chunk_runtimes():
+    is_land = np.zeros((4, 4), dtype=bool)
+    is_land[0, 0] = is_land[0, 1] = is_land[1, 1] = True
+    is_land[2, 3] = True
+    pixel_runtimes = np.full((4, 4), np.nan)
+    pixel_runtimes[0, 0], pixel_runtimes[0, 1] = 1.0, 3.0
+
+    chunk_indices = [(0, 0), (2, 2), (0, 2)]
+
+    # without any history: number of land pixels, 0 for chunks without land pixels
+    estimates = estimate_chunk_runtimes(chunk_indices, [2, 2], is_land)
+    np.testing.assert_array_equal(estimates, [3, 1, 0])
+
+    # unknown pixels get the median of the known pixels
+    estimates = estimate_chunk_runtimes(chunk_indices, [2, 2], is_land, pixel_runtimes)
+    np.testing.assert_array_equal(estimates, [6, 2, 0])
+
+    # run time of a chunk is used if no pixel of the chunk is known
+    estimates = estimate_chunk_runtimes(
+        chunk_indices, [2, 2], is_land, pixel_runtimes, chunk_runtimes={(2, 2): 10.0}
+    )
+    np.testing.assert_array_equal(estimates, [6, 10, 0])
+
+
+def test_load_chunk_runtimes(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, "INTERIM_DIR", tmp_path)
+
+    # no run.yaml files yet
+    assert load_chunk_runtimes([5, 5]) == {}
+
+    (tmp_path / "network_solution").mkdir()
+    for i, (chunk_size, runtime) in enumerate([([5, 5], 10.0), ([5, 5], 20.0), ([2, 2], 1.0)]):
+        run_data = {
+            "function": "optimize_network_chunk",
+            "input_params": {"chunk_size": chunk_size, "x_start_idx": 0, "y_start_idx": 5},
+            "runtime": runtime,
+        }
+        with open(tmp_path / "network_solution" / f"chunk-{i}.nc.run.yaml", "w") as f:
+            yaml.safe_dump(run_data, f)
+
+    assert load_chunk_runtimes([5, 5]) == {(0, 5): pytest.approx(15.0)}
+
+
+def test_create_work_units(tmp_path, monkeypatch):
+    rng = np.random.default_rng(42)
+    is_land = xr.DataArray(
+        rng.random((6, 4)) > 0.5,
+        dims=("x", "y"),
+        coords={"x": np.arange(6) * 0.25, "y": np.arange(4) * 0.25},
+        name="is_land",
+    )
+    is_land[:2] = False
+    monkeypatch.setattr(scheduler, "load_land_mask", lambda min_land_fraction: is_land)
+    monkeypatch.setattr(scheduler, "INTERIM_DIR", tmp_path)
+
+    out_fname = tmp_path / "work_units.csv"
+    create_work_units.__wrapped__(
+        x_idx_from_to=[0, 6],
+        y_idx_from_to=[0, 4],
+        chunk_size=[2, 2],
+        num_work_units=10,
+        inputs=[],
+        outputs=[out_fname],
+    )
+    work_units = pd.read_csv(out_fname)
+
+    # chunks without land pixels (x < 2) are not scheduled, one chunk per work unit
+    land_chunks = [
+        (x, y)
+        for x in range(0, 6, 2)
+        for y in range(0, 4, 2)
+        if is_land[x : x + 2, y : y + 2].any()
+    ]
+    assert sorted(zip(work_units.x_idx, work_units.y_idx)) == land_chunks
+    assert sorted(work_units.work_unit) == list(range(len(land_chunks)))
+
+    # no history: the estimate is the number of land pixels
+    num_land_pixels = [
+        is_land[x : x + 2, y : y + 2].sum().item()
+        for x, y in zip(work_units.x_idx, work_units.y_idx)
+    ]
+    np.testing.assert_array_equal(work_units.estimated_runtime, num_land_pixels)
@@ -0,0 +1,37 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from src import snakemake_config
+
+_worker = {}
+
+
+def _init_worker(value):
+    # fails if the config is not set before
+    from src import paths
+
+    _worker["value"] = value
+    _worker["testdir"] = paths.testdir
+    logging.info("worker initialized")
+
+
+def _worker_state():
+    return snakemake_config.config, _worker["value"], _worker["testdir"]
+
+
+def test_init_spawned_process(tmp_path):
+    log_file = tmp_path / "logfile.log"
+
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=snakemake_config.init_spawned_process,
+        initargs=(snakemake_config.config, log_file, __name__, "_init_worker", 42),
+    ) as executor:
+        config, value, testdir = executor.submit(_worker_state).result()
+
+    assert config == snakemake_config.config
+    assert value == 42
+    assert testdir == "-test"
+    assert "worker initialized" in log_file.read_text()
@@ -0,0 +1,181 @@
+import linopy
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.solver import METHODS
+from src.solver import STATISTICS
+from src.solver import WarmStart
+from src.solver import _assign_solution
+from src.solver import solve_direct
+from src.solver import solver_statistics
+
+highspy = pytest.importorskip("highspy")
+
+HIGHS_PARAMS = {"output_flag": False}
+
+# newer linopy versions warn about masked variables in expressions because their semantics will
+# change, the masked storage level at the first time step should be simply left out as before
+pytestmark = pytest.mark.filterwarnings("ignore:Variable 'storage' has absent slots")
+
+
+def create_model(demand=(1.0, 3.0, 2.0, 4.0)):
+    """A small LP: produce at least the demand at each time step with a capacity which needs to be
+    paid, production can be stored. One time step of the storage level is masked."""
+    model = linopy.Model()
+    time = pd.RangeIndex(len(demand), name="time")
+
+    size = model.add_variables(lower=0, name="size")
+    production = model.add_variables(lower=0, coords=[time], name="production")
+    storage = model.add_variables(
+        lower=0,
+        upper=2,
+        coords=[time],
+        mask=xr.DataArray(np.arange(len(demand)) > 0, coords=[time]),
+        name="storage",
+    )
+
+    model.add_constraints(production <= size, name="capacity")
+    model.add_constraints(
+        production + storage.shift(time=1) - storage >= xr.DataArray(list(demand), coords=[time]),
+        name="demand",
+    )
+    model.add_objective(10 * size + production.sum())
+
+    return model
+
+
+def test_solve_direct():
+    expected = create_model()
+    expected.solve(solver_name="highs", **HIGHS_PARAMS)
+
+    model = create_model()
+    stats = solve_direct(model, "highs", **HIGHS_PARAMS)
+
+    assert model.status == "ok"
+    assert model.termination_condition == "optimal"
+    assert model.objective.value == pytest.approx(expected.objective.value)
+    assert stats["objective"] == pytest.approx(expected.objective.value)
+    assert stats["runtime_solver"] >= 0
+
+    # same solution and duals as if solved by linopy, including NaN for the masked variable
+    xr.testing.assert_allclose(model.solution, expected.solution)
+    assert np.isnan(model.solution.storage[0])
+    for name in expected.constraints:
+        xr.testing.assert_allclose(model.constraints[name].dual, expected.constraints[name].dual)
+
+
+def test_solve_direct_warmstart():
+    warmstart = WarmStart()
+    assert not warmstart.matches("highs", 8, 8)
+
+    for demand in [(1.0, 3.0, 2.0, 4.0), (1.0, 3.0, 2.0, 4.0), (1.5, 2.5, 2.0, 3.0)]:
+        cold_stats = solve_direct(create_model(demand), "highs", **HIGHS_PARAMS)
+        model = create_model(demand)
+        stats = solve_direct(model, "highs", warmstart=warmstart, **HIGHS_PARAMS)
+
+        # same optimum as a cold start, the warm start is replaced by the new solution
+        assert stats["objective"] == pytest.approx(cold_stats["objective"])
+        assert warmstart.solver_name == "highs"
+        assert warmstart.primal @ model.matrices.c == pytest.approx(stats["objective"])
+
+    # the same model again: the previous basis is already optimal
+    stats = solve_direct(create_model(demand), "highs", warmstart=warmstart, **HIGHS_PARAMS)
+    assert stats["simplex_iterations"] == 0
+
+
+def test_solve_direct_warmstart_mismatch():
+    warmstart = WarmStart()
+    solve_direct(create_model(), "highs", warmstart=warmstart, **HIGHS_PARAMS)
+    num_cols = len(warmstart.primal)
+
+    # a model with more time steps does not fit the previous solution, which is then ignored,
+    # i.e. a cold start
+    demand = (1.0, 3.0, 2.0, 4.0, 5.0, 0.5)
+    assert not warmstart.matches("highs", num_cols + 4, len(warmstart.dual) + 4)
+    cold_stats = solve_direct(create_model(demand), "highs", **HIGHS_PARAMS)
+    stats = solve_direct(create_model(demand), "highs", warmstart=warmstart, **HIGHS_PARAMS)
+    assert stats["objective"] == pytest.approx(cold_stats["objective"])
+    assert stats["simplex_iterations"] == cold_stats["simplex_iterations"]
+    assert len(warmstart.primal) == num_cols + 4
+
+    # a solution of another solver is not used either
+    assert not warmstart.matches("gurobi", len(warmstart.primal), len(warmstart.dual))
+
+
+def test_solve_direct_unknown_solver():
+    with pytest.raises(ValueError, match="not supported"):
+        solve_direct(create_model(), "glpk")
+
+
+def test_assign_solution():
+    model = create_model()
+    M = model.matrices
+
+    # values are given in the order of the columns and rows of the solver, i.e. without masked
+    # labels, use values which are easy to map back to the labels
+    primal = 0.5 * M.vlabels
+    dual = -1.0 * M.clabels
+    _assign_solution(model, primal, dual, objective=42.0)
+
+    assert model.objective.value == 42.0
+    assert model.status == "ok"
+
+    for name in model.variables:
+        labels = model.variables[name].labels
+        expected = xr.where(labels == -1, np.nan, 0.5 * labels)
+        xr.testing.assert_equal(model.variables[name].solution, expected.rename("solution"))
+    for name in model.constraints:
+        labels = model.constraints[name].labels
+        expected = xr.where(labels == -1, np.nan, -1.0 * labels)
+        xr.testing.assert_equal(model.constraints[name].dual, expected.rename("dual"))
+
+
+@pytest.mark.parametrize(
+    "solver_params, method",
+    [
+        ({"solver": "simplex"}, "simplex"),
+        ({"solver": "ipm"}, "barrier"),
+    ],
+)
+def test_solver_statistics(solver_params, method):
+    # once solved by linopy (solve_model() with io_api other than "direct") and once directly
+    model = create_model()
+    model.solve(solver_name="highs", **HIGHS_PARAMS, **solver_params)
+    stats_linopy = solver_statistics("highs", model.solver_model)
+    stats_direct = solve_direct(create_model(), "highs", **HIGHS_PARAMS, **solver_params)
+
+    M = model.matrices
+    for stats in (stats_linopy, stats_direct):
+        assert set(stats) == set(STATISTICS)
+        assert stats["method"] == METHODS.index(method)
+        assert stats["solver_status"] == int(highspy.HighsModelStatus.kOptimal)
+        assert stats["objective"] == pytest.approx(model.objective.value)
+        assert stats["num_rows"] == len(M.clabels)
+        assert stats["num_cols"] == len(M.vlabels)
+        assert stats["num_nonzeros"] == M.A.nnz
+        if method == "simplex":
+            assert stats["simplex_iterations"] > 0
+            assert stats["barrier_iterations"] == 0
+        else:
+            assert stats["barrier_iterations"] > 0
+
+
+def test_solver_statistics_presolve():
+    # presolve removes all rows and columns of a model with bounds only
+    model = linopy.Model()
+    x = model.add_variables(lower=0, coords=[pd.RangeIndex(3, name="time")], name="x")
+    model.add_constraints(x >= xr.DataArray([1.0, 2.0, 3.0], dims="time"), name="demand")
+    model.add_objective(x.sum())
+
+    stats = solve_direct(model, "highs", **HIGHS_PARAMS)
+    assert stats["simplex_iterations"] == stats["barrier_iterations"] == 0
+    assert stats["method"] == METHODS.index("presolve")
+    assert stats["objective"] == pytest.approx(6.0)
+
+
+def test_solver_statistics_unsupported_solver():
+    stats = solver_statistics("glpk", None)
+    assert set(stats) == set(STATISTICS)
+    assert all(np.isnan(value) for value in stats.values())
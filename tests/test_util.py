@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from src.util import land_mask
+from src.util import resample_mean
+from src.util import land_chunk_indices
+from src.util import group_profiles
+from src.util import serpentine_order
+
+
+def create_timeseries(start, num_time_steps, dims=("x", "y", "time"), freq="1h"):
+    rng = np.random.default_rng(42)
+    sizes = {"x": 3, "y": 4, "time": num_time_steps}
+    timeseries = xr.DataArray(
+        rng.random([sizes[dim] for dim in dims]),
+        dims=dims,
+        coords={
+            "time": pd.date_range(start, periods=num_time_steps, freq=freq),
+            "x": np.arange(3),
+            "y": np.linspace(40, 41, 4),
+            "lon": ("x", np.arange(3) * 0.25),
+        },
+        name="specific generation",
+    )
+    # a single NaN value and a window with NaN values only
+    timeseries[{"time": 0, "x": 0, "y": 0}] = np.nan
+    timeseries[{"time": slice(0, 8), "x": 1, "y": 1}] = np.nan
+    return timeseries
+
+
+@pytest.mark.parametrize(
+    "start, num_time_steps, time_period_h",
+    [
+        ("2011-01-01", 8760, "4h"),  # a full year
+        ("2011-01-01", 8760, "7h"),  # incomplete window at the end of the year
+        ("2011-01-01 01:00", 243, "4h"),  # incomplete windows at the start and at the end
+        ("2011-01-01 02:00", 100, "5h"),  # 24h is not a multiple of the window
+        ("2011-01-01", 50, "1h"),
+        ("2011-01-01 03:00", 2, "4h"),
+    ],
+)
+@pytest.mark.parametrize("dims", [("x", "y", "time"), ("time", "y", "x")])
+def test_resample_mean(start, num_time_steps, time_period_h, dims):
+    timeseries = create_timeseries(start, num_time_steps, dims)
+
+    expected = timeseries.resample(time=time_period_h).mean()
+    resampled = resample_mean(timeseries, time_period_h)
+
+    xr.testing.assert_allclose(resampled, expected, rtol=1e-13)
+    np.testing.assert_array_equal(resampled.time.values, expected.time.values)
+    assert resampled.dims == expected.dims
+
+    # dask with a single chunk in time, as in resample_timeseries()
+    resampled_dask = resample_mean(timeseries.chunk({"time": -1, "y": 2}), time_period_h)
+    xr.testing.assert_allclose(resampled_dask.compute(), expected, rtol=1e-13)
+
+
+def test_resample_mean_not_equidistant():
+    # e.g. test mode data: only the first two hours of each month
+    timeseries = create_timeseries("2011-01-01", 24 * 60).isel(time=[0, 1, 744, 745])
+
+    expected = timeseries.resample(time="4h").mean()
+    xr.testing.assert_identical(resample_mean(timeseries, "4h"), expected)
+
+
+def test_land_mask():
+    # the ERA5 land sea mask: latitude descending, longitude not sorted
+    land_sea_mask = xr.DataArray(
+        [[[0.0, 0.3, 0.0], [1.0, 0.0, 0.6]]],
+        dims=("time", "latitude", "longitude"),
+        coords={"latitude": [0.25, 0.0], "longitude": [0.0, 0.25, -0.25]},
+    )
+
+    is_land = land_mask(land_sea_mask)
+    assert is_land.dims == ("x", "y")
+    np.testing.assert_array_equal(is_land.x, [-0.25, 0.0, 0.25])
+    np.testing.assert_array_equal(is_land.y, [0.0, 0.25])
+    np.testing.assert_array_equal(is_land, [[True, False], [True, False], [False, True]])
+
+    is_land = land_mask(land_sea_mask, min_land_fraction=0.5)
+    np.testing.assert_array_equal(is_land, [[True, False], [True, False], [False, False]])
+    assert land_chunk_indices(is_land, (0, 3), (0, 2), chunk_size=(1, 2)) == [(0, 0), (1, 0)]
+
+
+def test_group_profiles():
+    rng = np.random.default_rng(42)
+    profiles = rng.random((6, 10))
+    profiles[2] = profiles[0]
+    profiles[4] = profiles[0] + 1e-3
+    profiles[5] = profiles[1]
+    profiles[[1, 5], 3] = np.nan
+
+    representatives, max_abs_diff = group_profiles(profiles)
+    np.testing.assert_array_equal(representatives, [0, 1, 0, 3, 4, 1])
+    np.testing.assert_array_equal(max_abs_diff, 0.0)
+
+    representatives, max_abs_diff = group_profiles(profiles, tolerance=1e-2)
+    np.testing.assert_array_equal(representatives, [0, 1, 0, 3, 0, 1])
+    np.testing.assert_allclose(max_abs_diff, [0, 0, 0, 0, 1e-3, 0])
+
+
+@pytest.mark.parametrize("num_x, num_y", [(5, 5), (3, 4), (1, 6), (6, 1)])
+def test_serpentine_order(num_x, num_y):
+    order = serpentine_order(num_x, num_y)
+
+    # every pixel exactly once
+    assert sorted(order) == [(x_idx, y_idx) for x_idx in range(num_x) for y_idx in range(num_y)]
+
+    # consecutive pixels are neighbours
+    for (x_idx, y_idx), (next_x_idx, next_y_idx) in zip(order[:-1], order[1:]):
+        assert abs(next_x_idx - x_idx) + abs(next_y_idx - y_idx) == 1